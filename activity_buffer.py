@@ -0,0 +1,82 @@
+import threading
+import logging
+from datetime import datetime
+from sqlalchemy import bindparam
+from database import db
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class ActivityBuffer:
+    """Write-behind buffer for last_used and last_login timestamps
+
+    Activity is recorded in memory and written in one transaction every
+    flush_interval seconds, repeated activity on the same row in between
+    becomes a single update. Timestamps are lost only if the process dies
+    without flushing, flush() runs again on shutdown.
+    """
+
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self.connections = {}  # Format: {connection_id: last_used}
+        self.users = {}  # Format: {user_id: last_login}
+        self.lock = threading.Lock()
+        self.flushed = 0
+
+    def touch_connection(self, connection_id, when=None):
+        """Record that a connection was used"""
+        with self.lock:
+            self._touch(self.connections, connection_id, when or datetime.utcnow())
+
+    def touch_user(self, user_id, when=None):
+        """Record that a user logged in"""
+        with self.lock:
+            self._touch(self.users, user_id, when or datetime.utcnow())
+
+    def pending(self):
+        with self.lock:
+            return len(self.connections) + len(self.users)
+
+    def flush(self):
+        """Write buffered timestamps in one transaction, needs an app context"""
+        from auth import User, SSHConnection
+
+        with self.lock:
+            connections, self.connections = self.connections, {}
+            users, self.users = self.users, {}
+        if not connections and not users:
+            return 0
+
+        try:
+            for model, column, values in ((SSHConnection, 'last_used', connections),
+                                          (User, 'last_login', users)):
+                if not values:
+                    continue
+                table = model.__table__
+                update = (table.update()
+                          .where(table.c.id == bindparam('row_id'))
+                          .values({column: bindparam('timestamp')}))
+                db.session.execute(update, [{'row_id': row_id, 'timestamp': timestamp}
+                                            for row_id, timestamp in values.items()])
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            # Keep them for the next flush, newer activity wins
+            with self.lock:
+                for row_id, timestamp in connections.items():
+                    self._touch(self.connections, row_id, timestamp)
+                for row_id, timestamp in users.items():
+                    self._touch(self.users, row_id, timestamp)
+            logger.error(f"Failed to write activity timestamps: {e}")
+            return 0
+
+        count = len(connections) + len(users)
+        self.flushed += count
+        return count
+
+    def _touch(self, values, row_id, timestamp):
+        if row_id not in values or values[row_id] < timestamp:
+            values[row_id] = timestamp
+
+# Global instance
+activity_buffer = ActivityBuffer(Config.DB_ACTIVITY_FLUSH_SECONDS)
@@ -1,17 +1,33 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, Response
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from config import Config
-from database import db
+from database import db, ensure_schema, has_search_index, SEARCH_TABLE, SEARCH_MIN_LENGTH
 from auth import User, SSHConnection
 from ssh_manager import ssh_manager
 import eventlet
+from eventlet import tpool
+import click
+import codecs
+import atexit
+import json
 import os
+import signal
+import sys
 import logging
 import threading
+import struct
+import time
 from persistent_ssh import persistent_manager
+from ssh_pool import transport_pool, credential_fingerprint
+from ssh_connect import connect_ssh
+from ssh_keys import key_loader
+from activity_buffer import activity_buffer
+from user_cache import user_cache
+from session_registry import session_registry, WORKER_ID
+from worker_router import run_workers, worker_for_user
 from datetime import datetime, timedelta
-from sqlalchemy import or_
+from sqlalchemy import or_, tuple_
 import random
 
 # Setup logging
@@ -60,14 +76,26 @@ login_manager.login_message_category = 'warning'
 # Initialize SocketIO for real-time communication
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet', logger=False, engineio_logger=False)
 
+# OS threads for blocking SSH handshakes, see run_ssh_handshake
+tpool.set_num_threads(app.config['SSH_HANDSHAKE_WORKERS'])
+# Fan-outs to many dead hosts must not take every handshake worker
+fanout_handshakes = eventlet.semaphore.Semaphore(
+    max(1, min(app.config['SSH_FANOUT_HANDSHAKES'], app.config['SSH_HANDSHAKE_WORKERS'] - 1)))
+
 # ========== LIVE SESSION TRACKING ==========
-active_ssh_sessions = {}  # Format: {session_id: {"user_id": X, "connection_id": Y, "start_time": datetime}}
-user_active_sessions = {}  # Format: {user_id: set(session_ids)}
+# Sessions per user live in session_registry, shared between workers if configured
+socket_channels = {}  # Format: {socket_sid: {channel_id: session_id}} sessions attached to a socket
 session_lock = threading.Lock()
 
+# Binary terminal data frames: 4-byte channel id followed by the raw payload.
+# Compressed frames also carry the uncompressed length for ordering and acks.
+DATA_FRAME_HEADER = struct.Struct('>I')
+ZDATA_FRAME_HEADER = struct.Struct('>II')
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Runs for every request and Socket.IO event, served from memory
+    return user_cache.load(int(user_id))
 
 # Timezone offset untuk Indonesia (WIB = UTC+7)
 WIB_OFFSET = timedelta(hours=7)
@@ -120,6 +148,16 @@ def generate_captcha():
     
     return question, answer
 
+@app.after_request
+def set_worker_affinity(response):
+    """Tell the multi-worker router which worker owns this user's SSH sessions"""
+    workers = app.config['WEB_WORKERS']
+    if workers > 1 and current_user.is_authenticated:
+        worker = str(worker_for_user(current_user.id, workers))
+        if request.cookies.get(app.config['WORKER_AFFINITY_COOKIE']) != worker:
+            response.set_cookie(app.config['WORKER_AFFINITY_COOKIE'], worker, httponly=True, samesite='Lax')
+    return response
+
 @app.route('/get_captcha', methods=['GET'])
 def get_captcha():
     """Generate new CAPTCHA and return as JSON"""
@@ -133,84 +171,138 @@ def get_captcha():
 # ========== LIVE SESSION HELPER FUNCTIONS ==========
 def add_active_session(session_id, user_id, connection_id):
     """Add a new active SSH session"""
-    with session_lock:
-        active_ssh_sessions[session_id] = {
-            "user_id": user_id,
-            "connection_id": connection_id,
-            "start_time": datetime.utcnow(),
-            "last_activity": datetime.utcnow()
-        }
-        
-        if user_id not in user_active_sessions:
-            user_active_sessions[user_id] = set()
-        user_active_sessions[user_id].add(session_id)
+    session_registry.add(session_id, user_id, connection_id)
     
     logger.info(f"✅ LIVE SESSION: Session {session_id} added for user {user_id}")
     return True
 
 def update_session_activity(session_id):
     """Update last activity time for a session"""
-    with session_lock:
-        if session_id in active_ssh_sessions:
-            active_ssh_sessions[session_id]["last_activity"] = datetime.utcnow()
+    session_registry.touch(session_id)
 
 def remove_active_session(session_id):
     """Remove an active SSH session"""
+    user_id = session_registry.remove(session_id)
+    if user_id:
+        logger.info(f"✅ LIVE SESSION: Session {session_id} removed")
+    return user_id
+
+def bind_socket_channel(sid, channel_id, session_id):
+    """Allow a socket to address a session by its binary channel id"""
     with session_lock:
-        if session_id in active_ssh_sessions:
-            user_id = active_ssh_sessions[session_id]["user_id"]
-            
-            # Remove from active_ssh_sessions
-            del active_ssh_sessions[session_id]
-            
-            # Remove from user_active_sessions
-            if user_id in user_active_sessions:
-                user_active_sessions[user_id].discard(session_id)
-                if not user_active_sessions[user_id]:  # Clean up empty sets
-                    del user_active_sessions[user_id]
-            
-            logger.info(f"✅ LIVE SESSION: Session {session_id} removed")
-            return user_id
-    return None
+        socket_channels.setdefault(sid, {})[channel_id] = session_id
 
-def get_user_active_session_count(user_id):
-    """Get number of active sessions for a user"""
+def unbind_socket_channel(sid, session_id):
+    """Drop a socket's channel id for a session"""
     with session_lock:
-        return len(user_active_sessions.get(user_id, set()))
+        channels = socket_channels.get(sid)
+        if channels:
+            for channel_id, bound_session in list(channels.items()):
+                if bound_session == session_id:
+                    del channels[channel_id]
+            if not channels:
+                del socket_channels[sid]
+
+def get_socket_channel_session(sid, channel_id):
+    """Resolve a binary channel id sent by a socket to its session"""
+    with session_lock:
+        return socket_channels.get(sid, {}).get(channel_id)
+
+def socket_has_session(sid, session_id):
+    """Whether a session was started or reattached by this socket"""
+    with session_lock:
+        return session_id in socket_channels.get(sid, {}).values()
+
+def take_over_session(sid, session_id):
+    """Detach a session from the other sockets still bound to it
+    
+    Those are reloaded tabs and dropped connections whose disconnect the
+    server hasn't seen yet. The session can be reattached to sid afterwards.
+    """
+    with session_lock:
+        stale = [other for other, channels in socket_channels.items()
+                 if other != sid and session_id in channels.values()]
+    
+    for other in stale:
+        unbind_socket_channel(other, session_id)
+        leave_room(ssh_output_room(session_id), sid=other)
+        socketio.emit('ssh_error', {'message': 'Session opened in another window'}, to=other)
+    
+    return persistent_manager.detach_session(session_id)
+
+def get_user_active_session_count(user_id):
+    """Get number of active sessions for a user, across all workers"""
+    return session_registry.count_for_user(user_id)
 
 def get_all_active_sessions():
     """Get all active sessions (for debugging)"""
-    with session_lock:
-        return active_ssh_sessions.copy()
+    return session_registry.all_sessions()
+
+def ssh_output_room(session_id):
+    """Socket.IO room that receives pushed output for a persistent session"""
+    return f'ssh_{session_id}'
+
+def deliver_persistent_output(session_id):
+    """Push queued output of one session to its room"""
+    output, size = persistent_manager.take_output(session_id)
+    if not output:
+        return
+
+    if isinstance(output, bytes):
+        channel_id = persistent_manager.get_channel_id(session_id)
+        if channel_id is None:
+            return
+
+        compressed = persistent_manager.compress_output(session_id, output)
+        if compressed is not None:
+            socketio.emit('ssh_zdata',
+                          ZDATA_FRAME_HEADER.pack(channel_id, len(output)) + compressed,
+                          room=ssh_output_room(session_id))
+        else:
+            socketio.emit('ssh_data',
+                          DATA_FRAME_HEADER.pack(channel_id) + output,
+                          room=ssh_output_room(session_id))
+    else:
+        socketio.emit('ssh_output', {
+            'session_id': session_id,
+            'data': output,
+            'bytes': size
+        }, room=ssh_output_room(session_id))
+
+def probe_compression_rtt(sid, session_id, samples=3):
+    """Turn compression off for LAN clients, judged by the best of a few round trips"""
+    best_ms = None
+    for _ in range(samples):
+        eventlet.sleep(1)
+        replied = eventlet.event.Event()
+        sent = time.monotonic()
+        socketio.emit('ssh_rtt_probe', {'session_id': session_id}, to=sid,
+                      callback=lambda *args, sent=sent: replied.send(time.monotonic() - sent))
+
+        rtt = None
+        with eventlet.Timeout(5, False):
+            rtt = replied.wait()
+        if rtt is None:
+            return
+
+        best_ms = rtt * 1000 if best_ms is None else min(best_ms, rtt * 1000)
+        if best_ms < app.config['SSH_COMPRESSION_LAN_RTT_MS']:
+            persistent_manager.disable_compression(
+                session_id, f'LAN client ({best_ms:.1f} ms round trip)')
+            return
 
-def cleanup_inactive_sessions_background():
-    """Background task to cleanup inactive sessions"""
+def push_persistent_output():
+    """Background task to push persistent SSH output as soon as it arrives"""
+    wakeup = persistent_manager.enable_push()
     while True:
-        try:
-            # Clean sessions inactive for more than 30 minutes
-            cutoff_time = datetime.utcnow() - timedelta(minutes=30)
-            sessions_to_remove = []
-            
-            with session_lock:
-                for session_id, session_data in active_ssh_sessions.items():
-                    if session_data["last_activity"] < cutoff_time:
-                        sessions_to_remove.append(session_id)
-            
-            for session_id in sessions_to_remove:
-                user_id = remove_active_session(session_id)
-                if user_id:
-                    # Notify user about session cleanup
-                    socketio.emit('session_cleanup', 
-                                {'session_id': session_id, 'reason': 'inactive'},
-                                room=f'user_{user_id}')
-            
-            if sessions_to_remove:
-                logger.info(f"Cleaned up {len(sessions_to_remove)} inactive sessions")
-                
-        except Exception as e:
-            logger.error(f"Cleanup error: {e}")
+        # Sleep in the hub until a reactor signals new output
+        eventlet.hubs.trampoline(wakeup, read=True)
         
-        eventlet.sleep(60 * 5)  # Check every 5 minutes
+        for session_id in persistent_manager.take_ready():
+            try:
+                deliver_persistent_output(session_id)
+            except Exception as e:
+                logger.error(f"Output push error for {session_id}: {e}")
 
 def broadcast_session_count(user_id):
     """Broadcast session count update to user"""
@@ -220,13 +312,22 @@ def broadcast_session_count(user_id):
                 room=f'user_{user_id}')
 
 # ========== HELPER FUNCTIONS ==========
-def safe_decrypt_password(encrypted_password, connection_name):
+def run_ssh_handshake(func, *args, **kwargs):
+    """Run blocking paramiko work (connect, auth, channel setup) in the worker pool
+
+    paramiko sockets are not green, on the hub a slow or dead host would
+    freeze every other request and terminal until its timeout. The calling
+    greenlet waits for the result while the hub keeps running.
+    """
+    return tpool.execute(func, *args, **kwargs)
+
+def safe_decrypt_password(encrypted_password, connection_name, connection_id=None):
     """Safely decrypt password with error handling"""
     if not encrypted_password:
         return ''
 
     try:
-        decrypted = ssh_manager.decrypt_password(encrypted_password)
+        decrypted = ssh_manager.decrypt_password(encrypted_password, connection_id)
         if not decrypted:
             logger.warning(f"⚠ Empty decryption result for connection: {connection_name}")
             return ''
@@ -236,26 +337,54 @@ def safe_decrypt_password(encrypted_password, connection_name):
         return ''
 
 def check_password_validity(connection):
-    """Check if password is valid (can be decrypted)"""
-    if not connection.password:
-        return True  # No password is valid
+    """Check if password is valid (can be decrypted)
 
-    try:
-        decrypted = ssh_manager.decrypt_password(connection.password)
-        return bool(decrypted)
-    except:
-        return False
-
-def sort_connections_by_last_used(connections):
-    """Sort connections by last_used, handling None values"""
-    def get_sort_key(conn):
-        if conn.last_used:
-            return conn.last_used
-        else:
-            # Return a datetime far in the past for None values
-            return datetime.min
+    The result is kept on the connection with the fingerprint of the key it
+    was checked with, so it is only decrypted again after a key change.
+    """
+    if connection.password_checked_key == ssh_manager.key_fingerprint and connection.password_valid is not None:
+        return connection.password_valid
 
-    return sorted(connections, key=get_sort_key, reverse=True)
+    if not connection.password:
+        valid = True  # No password is valid
+    else:
+        try:
+            valid = bool(ssh_manager.decrypt_password(connection.password, connection.id))
+        except:
+            valid = False
+
+    connection.password_valid = valid
+    connection.password_checked_key = ssh_manager.key_fingerprint
+    return valid
+
+def mark_password_valid(connection):
+    """Record that a freshly encrypted password is valid"""
+    connection.password_valid = True
+    connection.password_checked_key = ssh_manager.key_fingerprint
+
+def connection_account(connection):
+    """SSH account a connection logs in to, as the transport pool keys it"""
+    return (connection.user_id, connection.hostname, int(connection.port), connection.username)
+
+def forget_connection_secrets(connection_id, account=None):
+    """Drop cached secrets of an edited or deleted connection"""
+    ssh_manager.credentials.invalidate(connection_id)
+    key_loader.evict(connection_id)
+    if account:
+        # Pooled transports were authenticated with the old credentials
+        transport_pool.evict_account(*account)
+
+def close_detached_sessions(connection_id):
+    """Close the detached shells of an edited or deleted connection, returns how many
+    
+    Nobody can reattach to them once the connection is gone, and after an
+    edit they would still talk to the old host or account.
+    """
+    # Closing waits on the channel and transport, keep it off the hub
+    closed = run_ssh_handshake(persistent_manager.close_detached, connection_id)
+    for session_id in closed:
+        remove_active_session(session_id)
+    return len(closed)
 
 # ========== SOCKETIO CONNECTION HANDLERS ==========
 @socketio.on('connect')
@@ -268,6 +397,13 @@ def handle_connect():
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handle client disconnection"""
+    with session_lock:
+        channels = socket_channels.pop(request.sid, {})
+    
+    # Keep the shells running, the browser can reattach after a reload or network drop
+    for session_id in channels.values():
+        persistent_manager.detach_session(session_id)
+    
     if current_user.is_authenticated:
         logger.info(f"📡 SocketIO: User {current_user.id} disconnected")
 
@@ -283,30 +419,49 @@ def handle_start_persistent_ssh(data):
             emit('ssh_error', {'message': 'Unauthorized'})
             return
 
-        # Decrypt password
-        decrypted_password = safe_decrypt_password(connection.password, connection.name)
-        if not decrypted_password and not connection.private_key:
-            emit('ssh_error', {'message': 'Password decryption failed. Please edit connection.'})
-            return
+        # Pick up a session left behind by a reload or dropped connection. The
+        # tab resuming its own session takes it over from a socket not yet gone
+        owner = (current_user.id, connection.id)
+        result = None
+        resume_id = data.get('resume')
+        if resume_id and resume_id in persistent_manager.sessions_for_connection(connection.id):
+            take_over_session(request.sid, resume_id)
+            detached_id = resume_id
+        else:
+            detached_id = persistent_manager.find_detached(owner)
+        if detached_id:
+            result = persistent_manager.reattach_session(detached_id)
+
+        reattached = result is not None
+        if not reattached:
+            # Decrypt password
+            decrypted_password = safe_decrypt_password(connection.password, connection.name, connection.id)
+            if not decrypted_password and not connection.private_key:
+                emit('ssh_error', {'message': 'Password decryption failed. Please edit connection.'})
+                return
 
-        # Create persistent session
-        result = persistent_manager.create_session(
-            hostname=connection.hostname,
-            port=connection.port,
-            username=connection.username,
-            password=decrypted_password,
-            private_key=connection.private_key
-        )
+            # Create persistent session
+            result = run_ssh_handshake(
+                persistent_manager.create_session,
+                hostname=connection.hostname,
+                port=connection.port,
+                username=connection.username,
+                password=decrypted_password,
+                private_key=connection.private_key,
+                owner=owner
+            )
 
         if result['success']:
             session_id = result['session_id']
 
             # ADD TO LIVE SESSION TRACKING
-            add_active_session(session_id, current_user.id, connection_id)
+            if reattached:
+                update_session_activity(session_id)
+            else:
+                add_active_session(session_id, current_user.id, connection_id)
             
             # Update last_used for connection
-            connection.last_used = datetime.utcnow()
-            db.session.commit()
+            connection.update_last_used()
 
             # Send initial output (banner, motd, etc.)
             if result.get('initial_output'):
@@ -315,15 +470,42 @@ def handle_start_persistent_ssh(data):
                     'data': result['initial_output']
                 })
 
+            # Push further output to this socket, clients that can't take it keep polling
+            push = False
+            binary = False
+            compression = False
+            if data.get('push') and app.config['SSH_OUTPUT_PUSH']:
+                join_room(ssh_output_room(session_id))
+                binary = bool(data.get('binary'))
+                compression = (binary and data.get('compression') == 'deflate' and
+                               app.config['SSH_OUTPUT_COMPRESSION'])
+                push = persistent_manager.start_push(session_id,
+                                                     acks=bool(data.get('ack')),
+                                                     binary=binary,
+                                                     compression=compression)
+                binary = push and binary
+                compression = binary and compression
+            bind_socket_channel(request.sid, result['channel_id'], session_id)
+
             # Broadcast session count update
             broadcast_session_count(current_user.id)
 
             emit('ssh_session_started', {
                 'session_id': session_id,
-                'message': 'Persistent SSH session started'
+                'channel': result['channel_id'],
+                'binary': binary,
+                'compression': 'deflate' if compression else None,
+                'push': push,
+                'reattached': reattached,
+                'timings': result.get('timings'),
+                'message': 'Persistent SSH session reattached' if reattached else 'Persistent SSH session started'
             })
             
-            logger.info(f"✅ SSH Session Started: {session_id} by user {current_user.id}")
+            # Compression doesn't pay off on a LAN, measure the round trip to find out
+            if compression:
+                socketio.start_background_task(probe_compression_rtt, request.sid, session_id)
+
+            logger.info(f"✅ SSH Session {'Reattached' if reattached else 'Started'}: {session_id} by user {current_user.id}")
         else:
             emit('ssh_error', {'message': result['message']})
 
@@ -338,7 +520,7 @@ def handle_persistent_ssh_input(data):
         session_id = data.get('session_id')
         input_data = data.get('data')
 
-        if not session_id or not input_data:
+        if not session_id or not input_data or not socket_has_session(request.sid, session_id):
             return
 
         # Update session activity
@@ -354,12 +536,36 @@ def handle_persistent_ssh_input(data):
         logger.error(f"Persistent SSH input error: {e}")
         emit('ssh_error', {'message': str(e)})
 
+@socketio.on('ssh_data')
+def handle_ssh_data(frame):
+    """Handle binary input frame for persistent SSH session"""
+    try:
+        if not isinstance(frame, (bytes, bytearray)) or len(frame) <= DATA_FRAME_HEADER.size:
+            return
+
+        channel_id, = DATA_FRAME_HEADER.unpack_from(frame)
+        session_id = get_socket_channel_session(request.sid, channel_id)
+        if not session_id:
+            return
+
+        # Update session activity
+        update_session_activity(session_id)
+
+        result = persistent_manager.send_input(session_id, bytes(frame[DATA_FRAME_HEADER.size:]))
+
+        if not result['success']:
+            emit('ssh_error', {'message': result['message']})
+
+    except Exception as e:
+        logger.error(f"Binary SSH input error: {e}")
+        emit('ssh_error', {'message': str(e)})
+
 @socketio.on('get_persistent_output')
 def handle_get_persistent_output(data):
     """Get output from persistent SSH session"""
     try:
         session_id = data.get('session_id')
-        if not session_id:
+        if not session_id or not socket_has_session(request.sid, session_id):
             return
 
         # Update session activity
@@ -375,6 +581,17 @@ def handle_get_persistent_output(data):
     except Exception as e:
         logger.error(f"Get persistent output error: {e}")
 
+@socketio.on('ssh_output_ack')
+def handle_ssh_output_ack(data):
+    """Release pushed output the browser has written to the terminal"""
+    try:
+        session_id = data.get('session_id')
+        size = int(data.get('bytes', 0))
+        if session_id and size > 0 and socket_has_session(request.sid, session_id):
+            persistent_manager.ack_output(session_id, size)
+    except Exception as e:
+        logger.error(f"Output ack error: {e}")
+
 @socketio.on('resize_persistent_terminal')
 def handle_resize_persistent_terminal(data):
     """Resize persistent terminal"""
@@ -383,7 +600,8 @@ def handle_resize_persistent_terminal(data):
         cols = data.get('cols', 80)
         rows = data.get('rows', 24)
 
-        persistent_manager.resize_terminal(session_id, rows, cols)
+        if socket_has_session(request.sid, session_id):
+            persistent_manager.resize_terminal(session_id, rows, cols)
     except Exception as e:
         logger.error(f"Resize persistent terminal error: {e}")
 
@@ -392,8 +610,10 @@ def handle_close_persistent_ssh(data):
     """Close persistent SSH session"""
     try:
         session_id = data.get('session_id')
-        if session_id:
-            persistent_manager.close_session(session_id)
+        if session_id and socket_has_session(request.sid, session_id):
+            run_ssh_handshake(persistent_manager.close_session, session_id)
+            leave_room(ssh_output_room(session_id))
+            unbind_socket_channel(request.sid, session_id)
             
             # REMOVE FROM LIVE SESSION TRACKING
             user_id = remove_active_session(session_id)
@@ -408,17 +628,59 @@ def handle_close_persistent_ssh(data):
         logger.error(f"Close persistent SSH error: {e}")
 
 # Background task to cleanup inactive sessions
-def cleanup_inactive_persistent_sessions():
-    """Periodically cleanup inactive SSH sessions in persistent manager"""
+def expire_inactive_sessions():
+    """Close SSH sessions as soon as their idle or detached time runs out"""
+    while True:
+        try:
+            expired = persistent_manager.expired_sessions()
+            for session_id in expired:
+                # Closing waits for the transport thread, keep it off the hub
+                run_ssh_handshake(persistent_manager.close_session, session_id)
+                user_id = remove_active_session(session_id)
+                if user_id:
+                    # Notify user about session cleanup
+                    socketio.emit('session_cleanup',
+                                {'session_id': session_id, 'reason': 'inactive'},
+                                room=f'user_{user_id}')
+                    broadcast_session_count(user_id)
+            if expired:
+                logger.info(f"Cleaned up {len(expired)} inactive SSH sessions")
+        except Exception as e:
+            logger.error(f"Session expiry error: {e}")
+
+        eventlet.sleep(app.config['SSH_EXPIRY_CHECK_SECONDS'])
+
+def registry_heartbeat():
+    """Keep this worker alive in the session registry and drop dead workers' sessions"""
     while True:
         try:
-            cleaned = persistent_manager.cleanup_inactive(timeout_minutes=30)
-            if cleaned > 0:
-                logger.info(f"Cleaned up {cleaned} inactive SSH sessions from persistent manager")
+            for user_id in session_registry.heartbeat():
+                broadcast_session_count(user_id)
         except Exception as e:
-            logger.error(f"Persistent manager cleanup error: {e}")
+            logger.error(f"Session registry heartbeat error: {e}")
+        eventlet.sleep(app.config['SESSION_REGISTRY_HEARTBEAT_SECONDS'])
 
-        eventlet.sleep(60 * 5)  # Check every 5 minutes
+def flush_activity_timestamps():
+    """Periodically write buffered last_used/last_login timestamps"""
+    while True:
+        eventlet.sleep(activity_buffer.flush_interval)
+        flush_activity()
+
+def flush_activity():
+    try:
+        with app.app_context():
+            activity_buffer.flush()
+    except Exception as e:
+        logger.error(f"Activity flush error: {e}")
+
+def evict_idle_transports():
+    """Periodically close pooled SSH transports nobody is using"""
+    while True:
+        eventlet.sleep(app.config['SSH_POOL_EVICT_SECONDS'])
+        try:
+            transport_pool.evict_idle()
+        except Exception as e:
+            logger.error(f"Transport pool eviction error: {e}")
 
 # ========== ROUTES ==========
 @app.route('/')
@@ -488,42 +750,28 @@ def logout():
     flash('You have been logged out.', 'info')
     return redirect(url_for('login'))
 
+# Connections listed on the dashboard, the rest are on the connections page
+DASHBOARD_CONNECTIONS = 7
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    # Get user's SSH connections
-    connections = SSHConnection.query.filter_by(user_id=current_user.id).all()
-
-    # Sort connections by last_used (handling None values)
-    sorted_connections = sort_connections_by_last_used(connections)
+    # Only fetch what the dashboard shows, ordered and limited by the
+    # (user_id, last_used) index. Never used connections sort last.
+    user_connections = SSHConnection.query.filter_by(user_id=current_user.id)
+    connection_count = user_connections.count()
+    connections = user_connections.order_by(SSHConnection.last_used.desc()).limit(DASHBOARD_CONNECTIONS).all()
 
     # Calculate active connections (LIVE SESSIONS)
     active_count = get_user_active_session_count(current_user.id)
 
-    # Get recent activity (last 24 hours)
-    recent_activity = []
-    for conn in connections:
-        if conn.last_used:
-            time_diff = datetime.utcnow() - conn.last_used
-            if time_diff.total_seconds() < 86400:  # 24 hours
-                recent_activity.append(conn)
-
-    # Sort recent activity by last_used (most recent first)
-    recent_activity.sort(key=lambda x: x.last_used, reverse=True)
-    # Get only the 3 most recent activities
-    recent_activity = recent_activity[:3]
-
-    # Add password validity check for each connection
-    for conn in connections:
-        conn.password_valid = check_password_validity(conn)
-
     # Debug logging
     logger.info(f"📊 Dashboard: User {current_user.id} has {active_count} active sessions")
 
     return render_template('dashboard.html',
-                        connections=sorted_connections,
-                        active_count=active_count,
-                        recent_activity=recent_activity)
+                        connections=connections,
+                        connection_count=connection_count,
+                        active_count=active_count)
 
 @app.route('/api/active_sessions')
 @login_required
@@ -545,48 +793,141 @@ def debug_sessions():
     return jsonify({
         'user_active_count': user_active,
         'all_active_sessions': all_active,
-        'user_active_sessions': user_active_sessions.get(current_user.id, [])
+        'compression': persistent_manager.compression_stats(),
+        'transport_pool': transport_pool.stats(),
+        'pending_activity': activity_buffer.pending(),
+        'user_cache': user_cache.stats(),
+        'session_startup': persistent_manager.startup_stats(),
+        'user_active_sessions': session_registry.sessions_for_user(current_user.id),
+        'user_local_sessions': persistent_manager.sessions_for_user(current_user.id),
+        'worker': WORKER_ID
     })
 
+CONNECTIONS_PER_PAGE = 9
+
+def connection_search_filter(search_query):
+    """Filter matching search_query in connection name, hostname or username"""
+    if len(search_query) >= SEARCH_MIN_LENGTH and has_search_index():
+        # Quoted as one phrase, so the text is matched literally
+        phrase = '"' + search_query.replace('"', '""') + '"'
+        return SSHConnection.id.in_(
+            db.select(db.literal_column('rowid'))
+            .select_from(db.text(SEARCH_TABLE))
+            .where(db.text(f"{SEARCH_TABLE} MATCH :phrase").bindparams(phrase=phrase))
+        )
+
+    return or_(
+        SSHConnection.name.ilike(f'%{search_query}%'),
+        SSHConnection.hostname.ilike(f'%{search_query}%'),
+        SSHConnection.username.ilike(f'%{search_query}%')
+    )
+
+def seek_connections(query, cursor, forward, limit):
+    """Up to limit connections after cursor in page order, or before it
+    
+    Pages list never used connections first, then newest first, matching the
+    (user_id, last_used IS NULL, created_at) index with id breaking ties.
+    SQLite can't seek a row value that starts with an expression, so each
+    value of last_used IS NULL is walked as its own index range.
+    """
+    unused_column = SSHConnection.last_used.is_(None)
+    position = tuple_(SSHConnection.created_at, SSHConnection.id)
+
+    if cursor is None:
+        segments = [(True, None), (False, None)]
+    else:
+        unused = cursor.last_used is None
+        cursor_position = (cursor.created_at, cursor.id)
+        if forward:
+            segments = [(unused, position < cursor_position)] + ([(False, None)] if unused else [])
+        else:
+            segments = [(unused, position > cursor_position)] + ([] if unused else [(True, None)])
+
+    if forward:
+        order = [SSHConnection.created_at.desc(), SSHConnection.id.desc()]
+    else:
+        order = [SSHConnection.created_at.asc(), SSHConnection.id.asc()]
+
+    rows = []
+    for unused, condition in segments:
+        segment = query.filter(unused_column == unused)
+        if condition is not None:
+            segment = segment.filter(condition)
+        rows += segment.order_by(*order).limit(limit - len(rows)).all()
+        if len(rows) >= limit:
+            break
+    return rows
+
+def keyset_page(query, after=None, before=None, per_page=CONNECTIONS_PER_PAGE):
+    """One page of connections after or before the connection with the given id
+    
+    Seeks straight to the cursor through the index instead of skipping rows
+    with OFFSET, and looks one row ahead instead of counting the rest.
+    """
+    cursor_id = before or after
+    cursor = db.session.get(SSHConnection, cursor_id) if cursor_id else None
+    if cursor is not None and cursor.user_id != current_user.id:
+        cursor = None
+
+    items = []
+    if cursor is not None and before:
+        # Walk backwards from the cursor, then put the page back in order
+        rows = seek_connections(query, cursor, False, per_page + 1)
+        has_prev = len(rows) > per_page
+        items = rows[:per_page][::-1]
+        # The cursor row may itself be outside a search
+        has_next = bool(items) and bool(seek_connections(query, items[-1], True, 1))
+    elif cursor is not None:
+        rows = seek_connections(query, cursor, True, per_page + 1)
+        has_next = len(rows) > per_page
+        items = rows[:per_page]
+        has_prev = bool(items) and bool(seek_connections(query, items[0], False, 1))
+
+    if not items:
+        # First page, also for a stale cursor
+        rows = seek_connections(query, None, True, per_page + 1)
+        has_next = len(rows) > per_page
+        items = rows[:per_page]
+        has_prev = False
+
+    return {
+        'items': items,
+        'has_prev': has_prev,
+        'has_next': has_next,
+        'prev_cursor': items[0].id if items else None,
+        'next_cursor': items[-1].id if items else None
+    }
+
 @app.route('/connections')
 @login_required
 def connections():
     # Get search query parameter
     search_query = request.args.get('search', '', type=str).strip()
     
-    # Get page number for pagination
-    page = request.args.get('page', 1, type=int)
+    # Keyset pagination: the id of the last (or first) connection on the
+    # adjacent page, so deep pages cost the same as the first one
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
     
     # Base query - filter by current user
     query = SSHConnection.query.filter_by(user_id=current_user.id)
     
     # Apply search filter if search query exists
     if search_query:
-        query = query.filter(
-            or_(
-                SSHConnection.name.ilike(f'%{search_query}%'),
-                SSHConnection.hostname.ilike(f'%{search_query}%')
-            )
-        )
-
-    query = query.order_by(
-        SSHConnection.last_used.is_(None).desc(),  
-        SSHConnection.created_at.desc()            
-    )
+        query = query.filter(connection_search_filter(search_query))
 
-    # Paginate results - 6 items per page
-    connections_paginated = query.paginate(
-        page=page,
-        per_page=9,
-        error_out=False
-    )
+    connections_page = keyset_page(query, after=after, before=before, per_page=CONNECTIONS_PER_PAGE)
     
     # Add password validity check for each connection
-    for conn in connections_paginated.items:
-        conn.password_valid = check_password_validity(conn)
+    for conn in connections_page['items']:
+        check_password_validity(conn)
+
+    # Checks only run for rows not yet checked with the current key
+    if db.session.dirty:
+        db.session.commit()
 
     return render_template('connections.html', 
-                        connections=connections_paginated,
+                        connections=connections_page,
                         search_query=search_query)
 
 @app.route('/add_connection', methods=['GET', 'POST'])
@@ -618,6 +959,7 @@ def add_connection():
             private_key=private_key if private_key else None,
             user_id=current_user.id
         )
+        mark_password_valid(connection)
 
         db.session.add(connection)
         db.session.commit()
@@ -638,6 +980,7 @@ def edit_connection(connection_id):
         return redirect(url_for('connections'))
 
     if request.method == 'POST':
+        account = connection_account(connection)
         connection.name = request.form.get('name')
         connection.hostname = request.form.get('hostname')
         connection.port = request.form.get('port', 22)
@@ -647,6 +990,7 @@ def edit_connection(connection_id):
         new_password = request.form.get('password')
         if new_password:
             connection.password = ssh_manager.encrypt_password(new_password)
+            mark_password_valid(connection)
 
         # Update private key only if provided
         new_key = request.form.get('private_key')
@@ -654,6 +998,9 @@ def edit_connection(connection_id):
             connection.private_key = new_key
 
         db.session.commit()
+        forget_connection_secrets(connection.id, account)
+        if close_detached_sessions(connection.id):
+            broadcast_session_count(current_user.id)
         flash('Connection updated successfully!', 'success')
         return redirect(url_for('connections'))
 
@@ -669,8 +1016,12 @@ def delete_connection(connection_id):
         flash('Access denied', 'danger')
         return redirect(url_for('connections'))
 
+    account = connection_account(connection)
     db.session.delete(connection)
     db.session.commit()
+    forget_connection_secrets(connection_id, account)
+    if close_detached_sessions(connection_id):
+        broadcast_session_count(current_user.id)
     flash('Connection deleted successfully!', 'success')
     return redirect(url_for('connections'))
 
@@ -692,41 +1043,19 @@ def test_connection():
         if not hostname or not username:
             return jsonify({'success': False, 'message': 'Hostname and username are required'})
 
-        # Test connection using paramiko directly
-        import paramiko
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-        try:
-            if private_key and private_key.strip():
-                # Key-based authentication
-                import io
-                key_file = io.StringIO(private_key)
-                private_key_obj = paramiko.RSAKey.from_private_key(key_file)
-                ssh.connect(
-                    hostname=hostname,
-                    port=port,
-                    username=username,
-                    pkey=private_key_obj,
-                    timeout=10,
-                    banner_timeout=10
-                )
-            else:
-                # Password authentication
-                ssh.connect(
-                    hostname=hostname,
-                    port=port,
-                    username=username,
-                    password=password,
-                    timeout=10,
-                    banner_timeout=10
-                )
+        def check():
+            ssh = connect_ssh(hostname, port, username, password,
+                              private_key=private_key if private_key.strip() else None)
 
             # Try to execute a simple command to verify
-            stdin, stdout, stderr = ssh.exec_command('echo "Connection successful"', timeout=5)
-            exit_status = stdout.channel.recv_exit_status()
+            try:
+                stdin, stdout, stderr = ssh.exec_command('echo "Connection successful"', timeout=5)
+                return stdout.channel.recv_exit_status()
+            finally:
+                ssh.close()
 
-            ssh.close()
+        try:
+            exit_status = run_ssh_handshake(check)
 
             if exit_status == 0:
                 return jsonify({'success': True, 'message': 'SSH connection successful'})
@@ -756,45 +1085,33 @@ def test_connection_direct(connection_id):
     # Decrypt password dengan error handling yang lebih baik
     decrypted_password = ''
     if connection.password:
-        decrypted_password = safe_decrypt_password(connection.password, connection.name)
+        decrypted_password = safe_decrypt_password(connection.password, connection.name, connection.id)
         if not decrypted_password and not connection.private_key:
             flash('⚠ Password tidak valid. Silakan edit koneksi ini dan masukkan password kembali.', 'warning')
             return redirect(url_for('edit_connection', connection_id=connection.id))
 
-    try:
-        import paramiko
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-        if connection.private_key:
-            import io
-            key_file = io.StringIO(connection.private_key)
-            private_key = paramiko.RSAKey.from_private_key(key_file)
-            ssh.connect(
-                hostname=connection.hostname,
-                port=connection.port,
-                username=connection.username,
-                pkey=private_key,
-                timeout=10
-            )
-        else:
-            if not decrypted_password:
-                flash('Password tidak tersedia. Silakan edit koneksi dan masukkan password.', 'danger')
-                return redirect(url_for('edit_connection', connection_id=connection.id))
+    if not connection.private_key and not decrypted_password:
+        flash('Password tidak tersedia. Silakan edit koneksi dan masukkan password.', 'danger')
+        return redirect(url_for('edit_connection', connection_id=connection.id))
 
-            ssh.connect(
-                hostname=connection.hostname,
-                port=connection.port,
-                username=connection.username,
-                password=decrypted_password,
-                timeout=10
-            )
+    hostname = connection.hostname
+    port = connection.port
+    username = connection.username
+    private_key_text = connection.private_key
+
+    def check():
+        ssh = connect_ssh(hostname, port, username, decrypted_password,
+                          private_key=private_key_text, connection_id=connection_id)
 
         # Test with simple command
-        stdin, stdout, stderr = ssh.exec_command('echo "Good"')
-        output = stdout.read().decode().strip()
+        try:
+            stdin, stdout, stderr = ssh.exec_command('echo "Good"')
+            return stdout.read().decode().strip()
+        finally:
+            ssh.close()
 
-        ssh.close()
+    try:
+        output = run_ssh_handshake(check)
 
         flash(f'✅ Connection test successful! {output}', 'success')
 
@@ -830,25 +1147,19 @@ def quick_connect():
         flash('Hostname and username are required', 'danger')
         return redirect(url_for('dashboard'))
 
-    # Create a temporary connection for testing
-    try:
-        import paramiko
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-        ssh.connect(
-            hostname=hostname,
-            port=int(port),
-            username=username,
-            password=password,
-            timeout=10
-        )
+    def check():
+        ssh = connect_ssh(hostname, int(port), username, password)
 
         # Execute a simple command
-        stdin, stdout, stderr = ssh.exec_command('whoami && pwd')
-        output = stdout.read().decode().strip()
+        try:
+            stdin, stdout, stderr = ssh.exec_command('whoami && pwd')
+            return stdout.read().decode().strip()
+        finally:
+            ssh.close()
 
-        ssh.close()
+    # Create a temporary connection for testing
+    try:
+        output = run_ssh_handshake(check)
 
         flash(f'✅ Quick connect successful! Output: {output}', 'success')
 
@@ -901,6 +1212,7 @@ def settings():
                 flash('Password must be at least 6 characters', 'danger')
             else:
                 current_user.change_password(new_password)
+                user_cache.invalidate(current_user.id)
                 flash('✅ Password changed successfully!', 'success')
 
         elif action == 'update_profile':
@@ -913,125 +1225,161 @@ def settings():
                 else:
                     current_user.username = new_username
                     db.session.commit()
+                    user_cache.invalidate(current_user.id)
                     flash('✅ Profile updated successfully!', 'success')
 
     return render_template('settings.html')
 
-@app.route('/execute_ssh_command', methods=['POST'])
-@login_required
-def execute_ssh_command():
-    """Execute SSH command via POST request"""
-    try:
-        data = request.get_json()
-        if not data:
-            return jsonify({'success': False, 'error': 'No data provided'})
+def resolve_command_request(data):
+    """Validate a command request, returns (connection, command, password, error)"""
+    if not data:
+        return None, None, None, 'No data provided'
 
-        connection_id = data.get('connection_id')
-        command = data.get('command', '').strip()
+    connection_id = data.get('connection_id')
+    command = data.get('command', '').strip()
 
-        if not connection_id or not command:
-            return jsonify({'success': False, 'error': 'Connection ID and command are required'})
+    if not connection_id or not command:
+        return None, None, None, 'Connection ID and command are required'
 
-        connection = SSHConnection.query.get_or_404(connection_id)
+    connection = SSHConnection.query.get_or_404(connection_id)
 
-        if connection.user_id != current_user.id:
-            return jsonify({'success': False, 'error': 'Unauthorized'})
+    if connection.user_id != current_user.id:
+        return None, None, None, 'Unauthorized'
 
-        # Decrypt password dengan error handling yang lebih baik
-        decrypted_password = ''
-        if connection.password:
-            decrypted_password = safe_decrypt_password(connection.password, connection.name)
-            if not decrypted_password and not connection.private_key:
-                return jsonify({
-                    'success': False,
-                    'error': '⚠ Password tidak valid. Silakan edit koneksi ini dan masukkan password kembali.'
-                })
+    # Decrypt password dengan error handling yang lebih baik
+    decrypted_password = ''
+    if connection.password:
+        decrypted_password = safe_decrypt_password(connection.password, connection.name, connection.id)
+        if not decrypted_password and not connection.private_key:
+            return None, None, None, '⚠ Password tidak valid. Silakan edit koneksi ini dan masukkan password kembali.'
+
+    if not connection.private_key and not decrypted_password:
+        return None, None, None, 'Password tidak tersedia. Silakan edit koneksi dan masukkan password.'
+
+    return connection, command, decrypted_password, None
+
+def exec_pool_key(connection, password):
+    """Transport pool key of a saved connection"""
+    return connection_account(connection) + (credential_fingerprint(password, connection.private_key),)
+
+def open_exec_channel(connection, password, command, pty=True, deadline=None, wait=True):
+    """Start a command on a pooled transport, returns (channel, lease)
+
+    With a deadline the whole handshake and opening the channel only get
+    the time left until it. With wait False returns None instead of waiting
+    for a transport another caller is opening.
+    """
+    def connect():
+        timeout = 10
+        if deadline is not None:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                raise TimeoutError('Timed out before connecting')
+
+        return connect_ssh(connection.hostname, connection.port, connection.username, password,
+                           private_key=connection.private_key, connection_id=connection.id,
+                           timeout=timeout)
+
+    # Borrow an authenticated transport, only the exec channel is new
+    opened = transport_pool.open_channel(exec_pool_key(connection, password), connect,
+                                         deadline=deadline, wait=wait)
+    if opened is None:
+        return None
+    channel, lease = opened
 
-        # Execute command using paramiko with better output handling
-        import paramiko
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    try:
+        # Get PTY for better formatting, stdout and stderr arrive merged then
+        if pty:
+            channel.get_pty(term='xterm', width=80, height=24)
 
-        try:
-            if connection.private_key:
-                import io
-                key_file = io.StringIO(connection.private_key)
-                private_key = paramiko.RSAKey.from_private_key(key_file)
-                ssh.connect(
-                    hostname=connection.hostname,
-                    port=connection.port,
-                    username=connection.username,
-                    pkey=private_key,
-                    timeout=10
-                )
-            else:
-                if not decrypted_password:
-                    return jsonify({
-                        'success': False,
-                        'error': 'Password tidak tersedia. Silakan edit koneksi dan masukkan password.'
-                    })
-
-                ssh.connect(
-                    hostname=connection.hostname,
-                    port=connection.port,
-                    username=connection.username,
-                    password=decrypted_password,
-                    timeout=10
-                )
+        # Execute command
+        channel.exec_command(command)
+    except Exception:
+        channel.close()
+        transport_pool.release(lease)
+        raise
 
-            # Get transport and open channel
-            transport = ssh.get_transport()
-            channel = transport.open_session()
+    return channel, lease
 
-            # Get PTY for better formatting
-            channel.get_pty(term='xterm', width=80, height=24)
+def iter_exec_output(channel, max_wait, heartbeat=None):
+    """Yield ('stdout' | 'stderr', bytes) chunks of a command as they arrive
 
-            # Execute command
-            channel.exec_command(command)
+    Waits on the channel's pipe through the eventlet hub so other requests
+    keep running while the command is quiet. Yields (None, b'') every
+    heartbeat seconds without output. Stops when the command exits or after
+    max_wait seconds.
+    """
+    deadline = time.time() + max_wait
+    fileno = channel.fileno()
 
-            # Read output with timeout
-            import select
-            import time
+    while True:
+        while channel.recv_ready():
+            yield 'stdout', channel.recv(app.config['SSH_BUFFER_SIZE'])
+        while channel.recv_stderr_ready():
+            yield 'stderr', channel.recv_stderr(app.config['SSH_BUFFER_SIZE'])
+
+        if channel.exit_status_ready():
+            # Get remaining output before exit
+            if not channel.recv_ready() and not channel.recv_stderr_ready():
+                return
+            continue
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
 
-            output = ""
-            error = ""
-            max_wait = 30  # Increased timeout for longer commands
+        if channel.eof_received:
+            # Output is complete, only the exit status is still on its way
+            eventlet.sleep(0.01)
+            continue
 
-            start_time = time.time()
+        try:
+            eventlet.hubs.trampoline(fileno, read=True,
+                                     timeout=min(remaining, heartbeat or remaining))
+        except eventlet.Timeout:
+            if heartbeat and time.time() < deadline:
+                yield None, b''
+
+def exec_exit_status(channel):
+    """Exit status of a finished command, None if it is still running"""
+    return channel.recv_exit_status() if channel.exit_status_ready() else None
 
-            while True:
-                # Check if channel is ready for reading
-                read_ready, _, _ = select.select([channel], [], [], 0.1)
+def sse_event(event, payload):
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
 
-                if channel.recv_ready():
-                    output += channel.recv(4096).decode('utf-8', errors='ignore')
+@app.route('/execute_ssh_command', methods=['POST'])
+@login_required
+def execute_ssh_command():
+    """Execute SSH command via POST request"""
+    try:
+        data = request.get_json()
+        connection, command, decrypted_password, error = resolve_command_request(data)
+        if error:
+            return jsonify({'success': False, 'error': error})
 
-                if channel.recv_stderr_ready():
-                    error += channel.recv_stderr(4096).decode('utf-8', errors='ignore')
+        lease = None
+        try:
+            channel, lease = run_ssh_handshake(open_exec_channel, connection, decrypted_password,
+                                               command, pty=data.get('pty', True))
 
-                # Check if channel is closed
-                if channel.exit_status_ready():
-                    # Get remaining output before exit
-                    while channel.recv_ready():
-                        output += channel.recv(4096).decode('utf-8', errors='ignore')
-                    while channel.recv_stderr_ready():
-                        error += channel.recv_stderr(4096).decode('utf-8', errors='ignore')
-                    break
+            output = []
+            error = []
+            max_wait = 30  # Increased timeout for longer commands
 
-                # Timeout check
-                if time.time() - start_time > max_wait:
-                    break
+            for stream, chunk in iter_exec_output(channel, max_wait):
+                (output if stream == 'stdout' else error).append(chunk)
 
             # Get exit status
-            exit_status = channel.recv_exit_status()
-
-            # Close channel and transport
-            channel.close()
-            transport.close()
+            exit_status = exec_exit_status(channel)
 
             # Update last used
             connection.update_last_used()
 
+            # Join raw chunks once so multibyte characters split across reads survive
+            output = b''.join(output).decode('utf-8', errors='replace')
+            error = b''.join(error).decode('utf-8', errors='replace')
+
             # Clean up output - ensure proper line endings
             output = output.replace('\r\n', '\n').replace('\r', '\n')
             error = error.replace('\r\n', '\n').replace('\r', '\n')
@@ -1054,10 +1402,225 @@ def execute_ssh_command():
             })
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)})
+        finally:
+            # Close channel, the transport stays in the pool
+            if lease:
+                channel.close()
+                transport_pool.release(lease)
 
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/execute_ssh_command/stream', methods=['POST'])
+@login_required
+def execute_ssh_command_stream():
+    """Execute SSH command and stream its output as server-sent events
+
+    Events: stdout and stderr carry {"data": text} chunks as they arrive,
+    the stream ends with exit {"exit_status": n} or error {"error": text}.
+    Nothing is buffered, so memory stays flat however large the output.
+    """
+    data = request.get_json(silent=True)
+    connection, command, decrypted_password, error = resolve_command_request(data)
+    if error:
+        return jsonify({'success': False, 'error': error})
+
+    try:
+        channel, lease = run_ssh_handshake(open_exec_channel, connection, decrypted_password,
+                                           command, pty=data.get('pty', True))
+    except paramiko.AuthenticationException:
+        return jsonify({
+            'success': False,
+            'error': 'Authentication failed. Please check username/password or SSH key.'
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+    connection.update_last_used()
+    max_wait = app.config['SSH_EXEC_STREAM_MAX_SECONDS']
+    heartbeat = app.config['SSH_EXEC_STREAM_HEARTBEAT_SECONDS']
+
+    def generate():
+        decoders = {
+            'stdout': codecs.getincrementaldecoder('utf-8')(errors='replace'),
+            'stderr': codecs.getincrementaldecoder('utf-8')(errors='replace')
+        }
+        try:
+            for stream, chunk in iter_exec_output(channel, max_wait, heartbeat):
+                if stream is None:
+                    # Keeps proxies from dropping a quiet stream
+                    yield ': keepalive\n\n'
+                    continue
+                text = decoders[stream].decode(chunk)
+                if text:
+                    yield sse_event(stream, {'data': text})
+
+            for stream, decoder in decoders.items():
+                text = decoder.decode(b'', final=True)
+                if text:
+                    yield sse_event(stream, {'data': text})
+
+            exit_status = exec_exit_status(channel)
+            if exit_status is None:
+                yield sse_event('error', {'error': f'Command still running after {max_wait}s'})
+            else:
+                yield sse_event('exit', {'exit_status': exit_status})
+        except Exception as e:
+            yield sse_event('error', {'error': str(e)})
+        finally:
+            # Also runs when the client goes away mid-stream
+            channel.close()
+            transport_pool.release(lease)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def run_fanout_host(connection, password, command, timeout, pty):
+    """Run a command on one host for a fan-out, returns its result dict
+
+    The host's timeout starts once it holds a handshake worker, the time
+    spent queueing for one is reported as queued_ms.
+    """
+    started = time.time()
+    queued = 0
+    result = {
+        'connection_id': connection.id,
+        'name': connection.name,
+        'hostname': connection.hostname,
+        'success': False
+    }
+
+    if not connection.private_key and not password:
+        result['error'] = 'Password tidak tersedia. Silakan edit koneksi dan masukkan password.'
+        return result
+
+    lease = None
+    try:
+        # Connect and auth are bounded by the host's timeout, so the worker is
+        # never abandoned mid-way. It runs while the host holds a worker or
+        # waits for a shared transport, not while it queues for a worker.
+        remaining = timeout
+        while lease is None:
+            waiting = time.time()
+            with fanout_handshakes:
+                queued += time.time() - waiting
+                deadline = time.time() + remaining
+                opened = run_ssh_handshake(open_exec_channel, connection, password, command, pty,
+                                           deadline=deadline, wait=False)
+            if opened is None:
+                # Another session is opening the transport to this account,
+                # wait for it without holding a worker
+                pool_key = exec_pool_key(connection, password)
+                while transport_pool.is_connecting(pool_key) and time.time() < deadline:
+                    eventlet.sleep(0.05)
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise TimeoutError('Timed out waiting for a shared connection')
+            else:
+                channel, lease = opened
+
+        output = []
+        error = []
+        size = 0
+        limit = app.config['SSH_FANOUT_OUTPUT_BYTES']
+        for stream, chunk in iter_exec_output(channel, max(0, deadline - time.time())):
+            if size < limit:
+                (output if stream == 'stdout' else error).append(chunk[:limit - size])
+            size += len(chunk)
+
+        exit_status = exec_exit_status(channel)
+        result.update({
+            'success': exit_status is not None,
+            'output': b''.join(output).decode('utf-8', errors='replace').rstrip(),
+            'error': b''.join(error).decode('utf-8', errors='replace').rstrip(),
+            'exit_status': exit_status,
+            'truncated': size > limit
+        })
+        if exit_status is None:
+            result['error'] = (result['error'] + '\n' if result['error'] else '') + 'Timed out'
+    except paramiko.AuthenticationException:
+        result['error'] = 'Authentication failed. Please check username/password or SSH key.'
+    except Exception as e:
+        result['error'] = str(e)
+    finally:
+        if lease:
+            channel.close()
+            transport_pool.release(lease)
+
+    result['elapsed_ms'] = int((time.time() - started) * 1000)
+    result['queued_ms'] = int(queued * 1000)
+    return result
+
+@app.route('/execute_ssh_command/fanout', methods=['POST'])
+@login_required
+def execute_ssh_command_fanout():
+    """Run one command on many saved connections, streaming results as server-sent events
+
+    Body: {"connection_ids": [...], "command": "...", "concurrency": n,
+    "timeout": seconds}. Each host's result is sent as a result event as
+    soon as it finishes, a done event with totals ends the stream.
+    """
+    data = request.get_json(silent=True) or {}
+    connection_ids = data.get('connection_ids') or []
+    command = data.get('command', '').strip()
+
+    if not isinstance(connection_ids, list) or not connection_ids or not command:
+        return jsonify({'success': False, 'error': 'Connection IDs and command are required'}), 400
+
+    max_concurrency = app.config['SSH_FANOUT_MAX_CONCURRENCY']
+    try:
+        connection_ids = [int(connection_id) for connection_id in connection_ids]
+        concurrency = min(max(1, int(data.get('concurrency') or max_concurrency)), max_concurrency)
+        timeout = min(max(1, float(data.get('timeout') or app.config['SSH_FANOUT_HOST_TIMEOUT'])),
+                      app.config['SSH_EXEC_STREAM_MAX_SECONDS'])
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Connection IDs, concurrency and timeout must be numbers'}), 400
+    pty = data.get('pty', True)
+
+    connections = SSHConnection.query.filter(
+        SSHConnection.user_id == current_user.id,
+        SSHConnection.id.in_(connection_ids)
+    ).all()
+    for connection in connections:
+        connection.update_last_used()
+    missing = set(connection_ids) - {connection.id for connection in connections}
+    targets = [(connection, safe_decrypt_password(connection.password, connection.name, connection.id))
+               for connection in connections]
+
+    def generate():
+        started = time.time()
+        results = eventlet.queue.Queue()
+        pool = eventlet.GreenPool(concurrency)
+
+        def run(connection, password):
+            results.put(run_fanout_host(connection, password, command, timeout, pty))
+
+        def dispatch():
+            # Blocks while the pool is full, results are streamed meanwhile
+            for connection, password in targets:
+                pool.spawn_n(run, connection, password)
+
+        eventlet.spawn_n(dispatch)
+
+        succeeded = 0
+        for connection_id in sorted(missing):
+            yield sse_event('result', {'connection_id': connection_id, 'success': False,
+                                       'error': 'Connection not found'})
+        for _ in targets:
+            result = results.get()
+            succeeded += result['success']
+            yield sse_event('result', result)
+
+        yield sse_event('done', {
+            'total': len(targets) + len(missing),
+            'succeeded': succeeded,
+            'failed': len(targets) + len(missing) - succeeded,
+            'elapsed_ms': int((time.time() - started) * 1000)
+        })
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # Route Delete all connection
 @app.route('/delete_all_connections')
 @login_required
@@ -1065,9 +1628,20 @@ def delete_all_connections():
     """Delete all SSH connections for current user"""
     try:
         # Delete all connections for current user
-        deleted_count = SSHConnection.query.filter_by(user_id=current_user.id).delete()
+        query = SSHConnection.query.filter_by(user_id=current_user.id)
+        accounts = {connection.id: connection_account(connection) for connection in query.with_entities(
+            SSHConnection.id, SSHConnection.user_id, SSHConnection.hostname,
+            SSHConnection.port, SSHConnection.username)}
+        deleted_count = query.delete()
         db.session.commit()
 
+        closed = 0
+        for connection_id, account in accounts.items():
+            forget_connection_secrets(connection_id, account)
+            closed += close_detached_sessions(connection_id)
+        if closed:
+            broadcast_session_count(current_user.id)
+
         flash(f'✅ Deleted {deleted_count} SSH connection(s)', 'success')
     except Exception as e:
         flash(f'❌ Error deleting connections: {str(e)}', 'danger')
@@ -1075,23 +1649,135 @@ def delete_all_connections():
     return redirect(url_for('settings'))
 
 
+# ========== ENCRYPTION KEY ROTATION ==========
+REENCRYPT_CHECKPOINT = os.path.join(app.instance_path, 'reencrypt.checkpoint')
+
+@app.cli.command('generate-encryption-key')
+def generate_encryption_key_command():
+    """Add a new primary encryption key, older keys stay for decryption"""
+    key_id = ssh_manager.add_encryption_key()
+    ssh_manager.load_keys()
+    click.echo(f"✓ New primary encryption key {key_id} added to {ssh_manager.key_file}")
+    click.echo("Run 'flask reencrypt-passwords' to move stored passwords to it")
+
+@app.cli.command('reencrypt-passwords')
+@click.option('--batch-size', default=500, show_default=True, help='Rows per batch and commit')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint and start from the first row')
+def reencrypt_passwords_command(batch_size, restart):
+    """Re-encrypt stored passwords with the primary key
+    
+    Walks ssh_connections in id order one batch at a time and commits each
+    batch, so memory use stays flat and SQLite is only locked briefly. The
+    last finished id is checkpointed, an interrupted run continues from there.
+    """
+    from sqlalchemy import bindparam
+    
+    ssh_manager.reload_keys_if_changed()
+    key_id = ssh_manager.primary_key_id
+    progress = {'key_id': key_id, 'last_id': 0, 'updated': 0, 'skipped': 0, 'failed': 0}
+    
+    if not restart and os.path.exists(REENCRYPT_CHECKPOINT):
+        with open(REENCRYPT_CHECKPOINT) as f:
+            checkpoint = json.load(f)
+        # A checkpoint for an older key is stale, rows are checked again
+        if checkpoint.get('key_id') == key_id:
+            progress = checkpoint
+            click.echo(f"Resuming after connection id {progress['last_id']}")
+    
+    table = SSHConnection.__table__
+    # A password changed since the batch was read is left alone, it was
+    # written with the primary key anyway
+    update = (table.update()
+              .where(table.c.id == bindparam('row_id'))
+              .where(table.c.password == bindparam('old_password'))
+              .values(password=bindparam('new_password'), password_valid=True,
+                      password_checked_key=ssh_manager.key_fingerprint))
+    
+    while True:
+        rows = db.session.execute(
+            db.select(table.c.id, table.c.password)
+            .where(table.c.id > progress['last_id'])
+            .order_by(table.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        
+        changes = []
+        for row_id, encrypted_password in rows:
+            if not ssh_manager.needs_reencrypt(encrypted_password):
+                progress['skipped'] += 1
+                continue
+            new_password = ssh_manager.reencrypt_password(encrypted_password)
+            if new_password is None:
+                # Encrypted with a key that is no longer in the keyring
+                progress['failed'] += 1
+                continue
+            changes.append({'row_id': row_id, 'old_password': encrypted_password,
+                            'new_password': new_password})
+        
+        updated = db.session.execute(update, changes).rowcount if changes else 0
+        db.session.commit()
+        
+        progress['updated'] += updated
+        progress['skipped'] += len(changes) - updated
+        progress['last_id'] = rows[-1][0]
+        with open(REENCRYPT_CHECKPOINT, 'w') as f:
+            json.dump(progress, f)
+        click.echo(f"  ... up to id {progress['last_id']}: {progress['updated']} re-encrypted, "
+                   f"{progress['skipped']} already current, {progress['failed']} undecryptable")
+    
+    if os.path.exists(REENCRYPT_CHECKPOINT):
+        os.remove(REENCRYPT_CHECKPOINT)
+    click.echo(f"✓ Done: {progress['updated']} password(s) re-encrypted with key {key_id}")
+    if progress['failed']:
+        click.echo(f"⚠ {progress['failed']} password(s) could not be decrypted with any key in the keyring")
+
+
 # ========== APPLICATION STARTUP ==========
 if __name__ == '__main__':
-    # ========== INISIALISASI DATABASE YANG AMAN ==========
-    print("🚀 Starting Web SSH Client...")
-
-    with app.app_context():
-        try:
-            # Cek apakah database sudah ada
-            from sqlalchemy import inspect
-            inspector = inspect(db.engine)
+    # Set for the worker processes of a multi-worker server, see worker_router
+    worker_index = os.environ.get('WORKER_INDEX')
+    is_router = worker_index is None and app.config['WEB_WORKERS'] > 1
+
+    # Workers use the database the router set up, two inits at once could drop it
+    if worker_index is None:
+        # ========== INISIALISASI DATABASE YANG AMAN ==========
+        print("🚀 Starting Web SSH Client...")
+
+        with app.app_context():
+            try:
+                # Cek apakah database sudah ada
+                from sqlalchemy import inspect
+                inspector = inspect(db.engine)
+
+                if 'users' not in inspector.get_table_names():
+                    print("📦 Database does not exist yet, create database and table...")
+                    # Buat semua tabel
+                    db.create_all()
+
+                    # Buat user admin default
+                    from auth import User
+                    admin = User(
+                        username='admin',
+                        password_hash=User.hash_password('admin'),
+                        is_admin=True,
+                        is_active=True
+                    )
+                    db.session.add(admin)
+                    db.session.commit()
+                    print("✅ Database created successfully")
+                    print("✅ Admin user created (username: admin, password: admin)")
+                else:
+                    print("✅ The database is ready to use.")
 
-            if 'users' not in inspector.get_table_names():
-                print("📦 Database does not exist yet, create database and table...")
-                # Buat semua tabel
+            except Exception as e:
+                print(f"❌ Database initialization error: {e}")
+                print("🔄 The database is ready to use.")
+                # Force create database
+                db.drop_all()
                 db.create_all()
 
-                # Buat user admin default
                 from auth import User
                 admin = User(
                     username='admin',
@@ -1101,38 +1787,33 @@ if __name__ == '__main__':
                 )
                 db.session.add(admin)
                 db.session.commit()
-                print("✅ Database created successfully")
-                print("✅ Admin user created (username: admin, password: admin)")
-            else:
-                print("✅ The database is ready to use.")
-
-        except Exception as e:
-            print(f"❌ Database initialization error: {e}")
-            print("🔄 The database is ready to use.")
-            # Force create database
-            db.drop_all()
-            db.create_all()
-
-            from auth import User
-            admin = User(
-                username='admin',
-                password_hash=User.hash_password('admin'),
-                is_admin=True,
-                is_active=True
-            )
-            db.session.add(admin)
-            db.session.commit()
-            print("✅ Database successfully recreated")
-
-    # Start background cleanup tasks
-    eventlet.spawn(cleanup_inactive_sessions_background)
-    eventlet.spawn(cleanup_inactive_persistent_sessions)
+                print("✅ Database successfully recreated")
+
+            # Outside the recreate fallback above, a failed migration must never drop data
+            try:
+                ensure_schema()
+            except Exception as e:
+                print(f"❌ Database migration error: {e}")
+
+    if not is_router:
+        # Start background cleanup tasks
+        eventlet.spawn(expire_inactive_sessions)
+        eventlet.spawn(evict_idle_transports)
+        eventlet.spawn(flush_activity_timestamps)
+        eventlet.spawn(registry_heartbeat)
+        # Buffered timestamps are written on any exit, docker stop sends SIGTERM
+        atexit.register(flush_activity)
+        atexit.register(session_registry.close)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        if app.config['SSH_OUTPUT_PUSH']:
+            eventlet.spawn(push_persistent_output)
     
-    print("✅ Live session tracking system started")
+        print("✅ Live session tracking system started")
 
     # ========== START SERVER ==========
     try:
-        print(f"""
+        if worker_index is None:
+            print(f"""
     ╔══════════════════════════════════════════╗
     ║           • Web SSH Client •             ║
     ╠══════════════════════════════════════════╣
@@ -1145,14 +1826,27 @@ if __name__ == '__main__':
     ║                                          ║
     ║  Press Ctrl+C to Stop Server             ║
     ╚══════════════════════════════════════════╝
-        """)
+            """)
+
+        if is_router:
+            # One worker process per core, each owns the SSH sessions of its users
+            print(f"✅ Starting {app.config['WEB_WORKERS']} workers")
+            run_workers(os.path.abspath(__file__), app.config['WEB_WORKERS'], '0.0.0.0', 5000)
+
+        # Workers only take connections from the router
+        if worker_index is None:
+            host, port = '0.0.0.0', 5000
+        else:
+            host, port = '127.0.0.1', app.config['WORKER_BASE_PORT'] + int(worker_index)
 
         # Run with SocketIO
         socketio.run(app,
-                    host='0.0.0.0',
-                    port=5000,
+                    host=host,
+                    port=port,
                     debug=False,
-                    allow_unsafe_werkzeug=True)
+                    allow_unsafe_werkzeug=True,
+                    # Write streamed responses as they are produced
+                    minimum_chunk_size=0)
 
     except KeyboardInterrupt:
         print("\n🛑 Server dihentikan oleh user")
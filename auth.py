@@ -1,6 +1,7 @@
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from database import db
+from activity_buffer import activity_buffer
 from datetime import datetime
 
 class User(UserMixin, db.Model):
@@ -30,9 +31,8 @@ class User(UserMixin, db.Model):
         return check_password_hash(self.password_hash, password)
     
     def update_last_login(self):
-        """Update last login timestamp"""
-        self.last_login = datetime.utcnow()
-        db.session.commit()
+        """Update last login timestamp, written in the next activity flush"""
+        activity_buffer.touch_user(self.id)
     
     def change_password(self, new_password):
         """Change user password"""
@@ -57,11 +57,20 @@ class SSHConnection(db.Model):
     private_key = db.Column(db.Text)  # For key-based auth
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_used = db.Column(db.DateTime)
+    password_valid = db.Column(db.Boolean)  # Whether the password decrypts...
+    password_checked_key = db.Column(db.String(16))  # ...with the key of this fingerprint
     
     # Foreign key
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     
+    # Per-user listings sorted by recency, served from the index instead of a sort
+    __table_args__ = (
+        db.Index('ix_ssh_connections_user_last_used', 'user_id', 'last_used'),
+        db.Index('ix_ssh_connections_user_created_at', 'user_id', 'created_at'),
+        # Order of the connections page: never used first, then newest
+        db.Index('ix_ssh_connections_user_unused_created_at', 'user_id', last_used.is_(None), 'created_at'),
+    )
+    
     def update_last_used(self):
-        """Update last used timestamp"""
-        self.last_used = datetime.utcnow()
-        db.session.commit()
+        """Update last used timestamp, written in the next activity flush"""
+        activity_buffer.touch_connection(self.id)
@@ -12,13 +12,73 @@ class Config:
         'database.db'
     )
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    DB_BUSY_TIMEOUT_MS = 5000  # How long a writer waits for the SQLite write lock
+    DB_ACTIVITY_FLUSH_SECONDS = 5  # last_used/last_login are written in batches this often
+    
+    # Live session registry: 'memory' for one worker, 'sqlite' to share it between workers
+    SESSION_REGISTRY = os.environ.get('SESSION_REGISTRY', 'memory')
+    SESSION_REGISTRY_PATH = os.path.join(
+        os.path.abspath(os.path.dirname(__file__)),
+        'instance',
+        'sessions.db'
+    )
+    SESSION_REGISTRY_TOUCH_SECONDS = 30  # Session activity is written at most this often
+    SESSION_REGISTRY_WORKER_TIMEOUT = 90  # Sessions of a worker silent this long are dropped
+    SESSION_REGISTRY_HEARTBEAT_SECONDS = 20
+    
+    # Multi-worker mode: WEB_WORKERS processes behind an affinity router on port 5000
+    WEB_WORKERS = int(os.environ.get('WEB_WORKERS', 1))
+    WORKER_BASE_PORT = 5001  # Workers listen on localhost from this port up
+    WORKER_AFFINITY_COOKIE = 'ssh_worker'
     
     # Session
     PERMANENT_SESSION_LIFETIME = timedelta(hours=2)
+    USER_CACHE_SECONDS = 60  # Logged in users are reloaded from the database this often
+    USER_CACHE_SIZE = 1024
     
     # SSH Settings
     SSH_TIMEOUT = 30
     SSH_BUFFER_SIZE = 65536
+    SSH_OUTPUT_PUSH = True  # Push terminal output to the browser, polling is the fallback
+    SSH_REACTOR_THREADS = 1  # Threads multiplexing reads for all persistent sessions
+    SSH_HANDSHAKE_WORKERS = 20  # Threads running SSH connects so a slow host never blocks the server
+    SSH_DNS_CACHE_SECONDS = 60  # How long resolved SSH host addresses are reused
+    SSH_CONNECT_ATTEMPT_DELAY_MS = 250  # Head start of each address before the next one is tried
+    SSH_FIRST_OUTPUT_TIMEOUT = 0.5  # Longest wait for the shell's first output on session start
+    SSH_KEY_CACHE_SIZE = 256  # Parsed private keys kept so connects skip PEM parsing
+    SSH_CREDENTIAL_CACHE_SECONDS = 300  # How long a decrypted password stays in memory
+    SSH_CREDENTIAL_CACHE_SIZE = 1024  # Decrypted passwords kept at most
+    SSH_SESSION_BUFFER_BYTES = 1024 * 1024  # Unacknowledged output per session before reads pause
+    SSH_GLOBAL_BUFFER_BYTES = 256 * 1024 * 1024  # Unacknowledged output across all sessions
+    SSH_OUTPUT_FLUSH_MS = 10  # Max time output is held back to coalesce it into one frame
+    SSH_OUTPUT_FLUSH_BYTES = 64 * 1024  # Flush a frame early once this much is waiting
+    SSH_OUTPUT_INTERACTIVE_MS = 500  # Output this soon after a keystroke counts as echo
+    SSH_OUTPUT_INTERACTIVE_BYTES = 1024  # ...if it is smaller than this, echo is never held back
+    SSH_SCROLLBACK_BYTES = 64 * 1024  # Output replayed when a browser reattaches to a session
+    SSH_IDLE_SESSION_MINUTES = 30  # Sessions without input or output are closed after this long
+    SSH_DETACHED_SESSION_MINUTES = 10  # How long a session waits for its browser to come back
+    SSH_EXPIRY_CHECK_SECONDS = 1  # Sessions are closed at most this long after their deadline
+    SSH_EXEC_STREAM_MAX_SECONDS = 3600  # Streamed commands are cut off after this long
+    SSH_EXEC_STREAM_HEARTBEAT_SECONDS = 15  # Keepalive comment on a quiet output stream
+    SSH_FANOUT_MAX_CONCURRENCY = 50  # Hosts a fan-out command runs on at the same time
+    SSH_FANOUT_HANDSHAKES = 8  # Handshake workers fan-outs may hold at once, the rest stay free for terminals
+    SSH_FANOUT_HOST_TIMEOUT = 30  # Default time a fan-out host gets to finish its command
+    SSH_FANOUT_OUTPUT_BYTES = 64 * 1024  # Output kept per fan-out host, the rest is dropped
+    
+    # Output compression, offered to binary clients that can inflate
+    SSH_OUTPUT_COMPRESSION = True
+    SSH_COMPRESSION_LEVEL = 6
+    SSH_COMPRESSION_MIN_BYTES = 256  # Smaller frames (keystroke echo) go out uncompressed
+    SSH_COMPRESSION_SAMPLE_BYTES = 64 * 1024  # Output seen before judging the ratio
+    SSH_COMPRESSION_MAX_RATIO = 0.8  # Turn off if compressed/raw stays above this
+    SSH_COMPRESSION_LAN_RTT_MS = 5  # Turn off for clients closer than this round trip
+    
+    # Connection pool, sessions to the same account share one SSH transport
+    SSH_POOL_IDLE_SECONDS = 300  # Close pooled transports without channels after this long
+    SSH_POOL_MAX_TRANSPORTS = 64  # Pooled transports across all users
+    SSH_POOL_EVICT_SECONDS = 30  # How often idle and dead transports are swept
+    SSH_POOL_CHANNEL_TIMEOUT = 10  # A pooled transport that can't open a channel in time is dropped
+    SSH_POOL_KEEPALIVE_SECONDS = 30  # Keepalive on pooled transports so dead peers are noticed
     
     # Application
     APP_NAME = "Web SSH Client"
@@ -1,5 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import DeclarativeBase
+from config import Config
+import sqlite3
 import os
 
 class Base(DeclarativeBase):
@@ -7,6 +11,18 @@ class Base(DeclarativeBase):
 
 db = SQLAlchemy(model_class=Base)
 
+@event.listens_for(Engine, 'connect')
+def configure_sqlite(dbapi_connection, connection_record):
+    """WAL lets readers run alongside the writer, writers wait instead of failing"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute(f'PRAGMA busy_timeout={int(Config.DB_BUSY_TIMEOUT_MS)}')
+    # Durable at checkpoints instead of every commit, safe with WAL
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
 def init_database(app):
     """Initialize database with tables"""
     with app.app_context():
@@ -31,3 +47,97 @@ def init_database(app):
             db.session.add(admin)
             db.session.commit()
             print("✓ Default admin user created (admin/admin)")
+
+def ensure_schema():
+    """Bring an existing database up to date with the models
+
+    db.create_all only creates missing tables, columns and indexes added to
+    existing tables later are created here. Needs an app context.
+    """
+    db.create_all()
+
+    inspector = inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=db.engine.dialect)
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                    print(f"✓ Added column {table.name}.{column.name}")
+
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            if db.engine.dialect.name == 'sqlite':
+                # SQLite reflection leaves out indexes on expressions
+                existing_indexes |= {name for name, in connection.execute(text(
+                    "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"
+                ), {'table': table.name})}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(connection)
+
+    ensure_search_index()
+
+# FTS5 trigram index over the searchable connection columns, trigrams make
+# MATCH a case-insensitive substring search like the ilike it replaces
+SEARCH_TABLE = 'ssh_connections_fts'
+SEARCH_COLUMNS = ('name', 'hostname', 'username')
+SEARCH_MIN_LENGTH = 3  # Shorter terms have no trigrams
+search_index = {'ready': None}
+
+def ensure_search_index():
+    """Create the connection search index and the triggers keeping it in sync
+
+    The index is external content over ssh_connections, triggers update it on
+    every insert, delete and change of a searchable column, including bulk
+    deletes that bypass the ORM. Rebuilt from the table whenever the triggers
+    were missing. Does nothing if SQLite has no FTS5 trigram tokenizer.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return False
+
+    columns = ', '.join(SEARCH_COLUMNS)
+    new_values = ', '.join(f'new.{column}' for column in SEARCH_COLUMNS)
+    old_values = ', '.join(f'old.{column}' for column in SEARCH_COLUMNS)
+    delete_old = (f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, {columns}) "
+                  f"VALUES ('delete', old.id, {old_values});")
+    insert_new = f"INSERT INTO {SEARCH_TABLE}(rowid, {columns}) VALUES (new.id, {new_values});"
+
+    with db.engine.begin() as connection:
+        try:
+            connection.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+                f"{columns}, content='ssh_connections', content_rowid='id', tokenize='trigram')"
+            ))
+        except Exception as e:
+            print(f"⚠ Connection search index not available, using LIKE search: {e}")
+            return False
+
+        triggers = {name for name, in connection.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'ssh_connections'"
+        ))}
+        statements = {
+            f'{SEARCH_TABLE}_insert': f"AFTER INSERT ON ssh_connections BEGIN {insert_new} END",
+            f'{SEARCH_TABLE}_delete': f"AFTER DELETE ON ssh_connections BEGIN {delete_old} END",
+            f'{SEARCH_TABLE}_update': (f"AFTER UPDATE OF {columns} ON ssh_connections "
+                                       f"BEGIN {delete_old} {insert_new} END"),
+        }
+        missing = [name for name in statements if name not in triggers]
+        for name in missing:
+            connection.execute(text(f"CREATE TRIGGER {name} {statements[name]}"))
+
+        if missing:
+            # Rows written while the triggers didn't exist are not indexed
+            connection.execute(text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')"))
+            print("✓ Built connection search index")
+
+    search_index['ready'] = True
+    return True
+
+def has_search_index():
+    """Whether connection searches can use the FTS index"""
+    if search_index['ready'] is None:
+        search_index['ready'] = (db.engine.dialect.name == 'sqlite' and bool(db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = :name"), {'name': SEARCH_TABLE}
+        ).first()))
+    return search_index['ready']
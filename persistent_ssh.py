@@ -1,52 +1,421 @@
 import paramiko
-import select
+import codecs
+import collections
+import heapq
+import itertools
+import selectors
+import socket
 import threading
-import queue
 import time
 import logging
-from io import StringIO
+import zlib
+from config import Config
+from ssh_pool import transport_pool, credential_fingerprint
+from ssh_connect import connect_ssh
 
 logger = logging.getLogger(__name__)
 
+class SessionReactor:
+    """Single thread that multiplexes reads for many SSH channels"""
+    
+    def __init__(self, manager, name):
+        self.manager = manager
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        
+        # Wakeup socket so registration changes are seen by a blocked select
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ, None)
+        
+        # Pending output flushes, only touched from the reactor thread
+        self._timers = []
+        self._timer_seq = itertools.count()
+        
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+    
+    def __len__(self):
+        """Number of channels watched by this reactor"""
+        return len(self.selector.get_map()) - 1
+    
+    def add(self, session):
+        """Start dispatching reads for a session channel"""
+        with self.lock:
+            self.selector.register(session.channel, selectors.EVENT_READ, session)
+        self._wake()
+    
+    def remove(self, channel):
+        """Stop dispatching reads for a channel"""
+        with self.lock:
+            try:
+                self.selector.unregister(channel)
+            except (KeyError, ValueError):
+                pass
+        self._wake()
+    
+    def schedule_flush(self, deadline, session):
+        """Mark a session ready for delivery at deadline (reactor thread only)"""
+        heapq.heappush(self._timers, (deadline, next(self._timer_seq), session))
+    
+    def _fire_timers(self):
+        now = time.monotonic()
+        while self._timers and self._timers[0][0] <= now:
+            deadline, _, session = heapq.heappop(self._timers)
+            # Skip flushes that were superseded by an earlier one
+            if session.flush_at == deadline:
+                session.flush_at = None
+                self.manager._mark_ready(session)
+    
+    def _wake(self):
+        try:
+            self._wake_w.send(b'\0')
+        except (BlockingIOError, InterruptedError):
+            pass
+    
+    def _run(self):
+        """Block until some channel is readable or a flush is due, then dispatch it"""
+        while True:
+            timeout = None
+            if self._timers:
+                timeout = max(0, self._timers[0][0] - time.monotonic())
+            
+            try:
+                events = self.selector.select(timeout)
+            except Exception as e:
+                logger.error(f"Reactor select error: {e}")
+                time.sleep(0.1)
+                continue
+            
+            for key, _ in events:
+                if key.data is None:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                    continue
+                
+                if not self.manager._read_channel(key.data):
+                    self.remove(key.fileobj)
+            
+            self._fire_timers()
+
+class OutputBuffer:
+    """Byte-capped output buffer for one session
+    
+    Delivered bytes stay counted until the browser acknowledges them, so a
+    stalled tab fills the buffer and the reader stops pulling from the channel.
+    """
+    
+    __slots__ = ('chunks', 'queued', 'unacked')
+    
+    def __init__(self):
+        self.chunks = collections.deque()
+        self.queued = 0   # Bytes waiting to be delivered
+        self.unacked = 0  # Bytes delivered but not acknowledged yet
+    
+    def __len__(self):
+        return self.queued + self.unacked
+    
+    def put(self, data):
+        self.chunks.append(data)
+        self.queued += len(data)
+    
+    def put_front(self, data):
+        """Queue data ahead of everything waiting"""
+        self.chunks.appendleft(data)
+        self.queued += len(data)
+    
+    def take(self, ack=True):
+        """Remove all queued bytes, keeping them counted as unacked if ack is False"""
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        self.queued = 0
+        if not ack:
+            self.unacked += len(data)
+        return data
+    
+    def ack(self, size):
+        """Release acknowledged bytes, returns how many were released"""
+        size = min(max(0, size), self.unacked)
+        self.unacked -= size
+        return size
+    
+    def clear(self):
+        self.chunks.clear()
+        self.queued = 0
+        self.unacked = 0
+
+class ScrollbackBuffer:
+    """Last few KB of a session's output, replayed when a browser reattaches"""
+    
+    __slots__ = ('chunks', 'size', 'limit')
+    
+    def __init__(self, limit):
+        self.chunks = collections.deque()
+        self.size = 0
+        self.limit = limit
+    
+    def put(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+        # Drop whole chunks that fall entirely outside the window
+        while len(self.chunks) > 1 and self.size - len(self.chunks[0]) >= self.limit:
+            self.size -= len(self.chunks.popleft())
+    
+    def get(self):
+        data = b''.join(self.chunks)
+        if len(data) <= self.limit:
+            return data
+        
+        # Replay from the first full line so the cut never falls inside a
+        # character or an escape sequence
+        data = data[-self.limit:]
+        newline = data.find(b'\n')
+        if newline != -1:
+            return data[newline + 1:]
+        
+        # One long line, at least skip the rest of a cut UTF-8 character
+        start = 0
+        while start < len(data) and 0x80 <= data[start] < 0xC0:
+            start += 1
+        return data[start:]
+
+class OutputCompressor:
+    """Persistent raw deflate stream for one session's output
+    
+    A single context for the whole session lets repeated prompt text compress
+    across frames. It switches itself off when frames stop shrinking enough.
+    """
+    
+    __slots__ = ('compressor', 'enabled', 'disabled_reason', 'raw_bytes',
+                 'compressed_bytes', 'cpu_seconds')
+    
+    def __init__(self):
+        self.compressor = zlib.compressobj(Config.SSH_COMPRESSION_LEVEL, zlib.DEFLATED, -15)
+        self.enabled = True
+        self.disabled_reason = None
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.cpu_seconds = 0.0
+    
+    def compress(self, data):
+        """Compress one frame, returns None when it should go out uncompressed"""
+        if not self.enabled or len(data) < Config.SSH_COMPRESSION_MIN_BYTES:
+            return None
+        
+        start = time.thread_time()
+        output = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.cpu_seconds += time.thread_time() - start
+        
+        self.raw_bytes += len(data)
+        self.compressed_bytes += len(output)
+        if (self.raw_bytes >= Config.SSH_COMPRESSION_SAMPLE_BYTES and
+                self.compressed_bytes > self.raw_bytes * Config.SSH_COMPRESSION_MAX_RATIO):
+            self.disable('output does not compress')
+        return output
+    
+    def disable(self, reason):
+        if self.enabled:
+            self.enabled = False
+            self.disabled_reason = reason
+    
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'disabled_reason': self.disabled_reason,
+            'raw_bytes': self.raw_bytes,
+            'compressed_bytes': self.compressed_bytes,
+            'saved_bytes': self.raw_bytes - self.compressed_bytes,
+            'ratio': round(self.compressed_bytes / self.raw_bytes, 3) if self.raw_bytes else None,
+            'cpu_ms': round(self.cpu_seconds * 1000, 2)
+        }
+
+class SSHSession:
+    """State of one persistent shell session
+    
+    Slotted, so an open shell costs a fixed set of fields rather than a
+    per-session dict. user_id and connection_id come from the session owner
+    and key the manager's secondary indexes.
+    """
+    
+    __slots__ = ('session_id', 'channel_id', 'user_id', 'connection_id', 'lease', 'channel',
+                 'output_buffer', 'scrollback', 'decoder', 'last_activity', 'is_alive',
+                 'attached', 'detached_at', 'push', 'acks', 'binary', 'compressor', 'paused',
+                 'flush_at', 'last_input', 'first_output', 'timings', 'reactor', 'expires_at')
+    
+    def __init__(self, session_id, channel_id, channel, lease, owner, timings):
+        self.session_id = session_id
+        self.channel_id = channel_id
+        self.user_id, self.connection_id = owner if owner else (None, None)
+        self.lease = lease
+        self.channel = channel
+        self.output_buffer = OutputBuffer()
+        self.scrollback = ScrollbackBuffer(Config.SSH_SCROLLBACK_BYTES)
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.last_activity = time.time()
+        self.is_alive = True
+        self.attached = True
+        self.detached_at = None
+        self.push = False
+        self.acks = False
+        self.binary = False
+        self.compressor = None
+        self.paused = False
+        self.flush_at = None
+        self.last_input = time.monotonic()
+        self.first_output = threading.Event()
+        self.timings = timings
+        self.reactor = None
+        self.expires_at = None  # Deadline of the session's entry in the expiry heap
+
 class PersistentSSHManager:
     """Manage persistent SSH shell sessions"""
     
     def __init__(self):
-        self.sessions = {}
+        self.sessions = {}  # Format: {session_id: SSHSession}
+        self.by_user = {}  # Format: {user_id: set(session_ids)}
+        self.by_connection = {}  # Format: {connection_id: set(session_ids)}
         self.lock = threading.Lock()
+        self.reactors = []
+        self._session_ids = itertools.count(1)
+        self.start_timings = collections.deque(maxlen=100)  # Phase timings of recent session starts
+        
+        # Push delivery: reactor threads mark sessions ready and poke the wakeup
+        # socket so a green consumer can drain them without polling
+        self.push_enabled = False
+        self._ready = set()
+        self._ready_lock = threading.Lock()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        
+        # Flow control: reads pause while a session buffer (or all of them
+        # together) is over its limit, letting the SSH window throttle the host
+        self.session_buffer_limit = Config.SSH_SESSION_BUFFER_BYTES
+        self.global_buffer_limit = Config.SSH_GLOBAL_BUFFER_BYTES
+        self.buffered_bytes = 0
+        self._paused = {}
+        self._flow_lock = threading.Lock()
+        
+        # Coalescing: output is pushed as one frame per flush window or size
+        # threshold, small output right after a keystroke goes out at once
+        self.flush_delay = Config.SSH_OUTPUT_FLUSH_MS / 1000
+        self.flush_bytes = Config.SSH_OUTPUT_FLUSH_BYTES
+        self.interactive_window = Config.SSH_OUTPUT_INTERACTIVE_MS / 1000
+        self.interactive_bytes = Config.SSH_OUTPUT_INTERACTIVE_BYTES
+        
+        # Expiry: one heap entry per session at its earliest possible close,
+        # activity only moves last_activity and stale entries are pushed back
+        # when they come up, so keystrokes never touch the heap
+        self.idle_timeout = Config.SSH_IDLE_SESSION_MINUTES * 60
+        self.detached_timeout = Config.SSH_DETACHED_SESSION_MINUTES * 60
+        self._expiry = []
     
-    def create_session(self, hostname, port, username, password, private_key=None):
-        """Create a persistent SSH shell session"""
+    def enable_push(self):
+        """Enable push delivery and return the socket to wait on for ready output"""
+        self.push_enabled = True
+        return self._wake_r
+    
+    def take_ready(self):
+        """Return session ids that have output waiting for push delivery"""
         try:
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            while self._wake_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        
+        with self._ready_lock:
+            ready = list(self._ready)
+            self._ready.clear()
+        return ready
+    
+    def start_push(self, session_id, acks=False, binary=False, compression=False):
+        """Switch a session to push delivery once its consumer is listening
+        
+        With acks the consumer reports written bytes through ack_output, until
+        then they count against the session buffer. Binary sessions hand out
+        raw bytes and leave decoding to the terminal, and may deflate them.
+        """
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if not session or not self.push_enabled:
+                return False
+            session.push = True
+            session.acks = acks
+            session.binary = binary
+            # A new consumer starts a new inflate stream
+            session.compressor = OutputCompressor() if binary and compression else None
             
-            if private_key:
-                # Key-based authentication
-                key_file = StringIO(private_key)
-                pkey = paramiko.RSAKey.from_private_key(key_file)
-                ssh.connect(
-                    hostname=hostname,
-                    port=port,
-                    username=username,
-                    pkey=pkey,
-                    timeout=10,
-                    banner_timeout=10
-                )
-            else:
-                # Password authentication
-                ssh.connect(
-                    hostname=hostname,
-                    port=port,
-                    username=username,
-                    password=password,
-                    timeout=10,
-                    banner_timeout=10
-                )
+            if binary:
+                # The initial output went out as text, bytes of a character
+                # split at its end are still in the decoder, send them first
+                with self._flow_lock:
+                    held = session.decoder.getstate()[0]
+                    session.decoder.reset()
+                    if held:
+                        session.output_buffer.put_front(held)
+                        self.buffered_bytes += len(held)
+            pending = session.output_buffer.queued > 0
+        
+        # Deliver anything that arrived before push was switched on
+        if pending:
+            self._mark_ready(session)
+        return True
+    
+    def _mark_ready(self, session):
+        """Queue a push session for delivery and wake the consumer"""
+        if not session.push:
+            return
+        
+        with self._ready_lock:
+            if session.session_id in self._ready:
+                return
+            self._ready.add(session.session_id)
+        
+        try:
+            self._wake_w.send(b'\0')
+        except (BlockingIOError, InterruptedError):
+            # Wakeup socket is full, consumer already has a pending wakeup
+            pass
+    
+    def create_session(self, hostname, port, username, password, private_key=None, owner=None):
+        """Create a persistent SSH shell session
+        
+        owner identifies who may reattach to the session after its browser
+        goes away, e.g. (user_id, connection_id). Sessions of the same user
+        to the same account share one pooled SSH transport.
+        
+        Every phase of the start is timed in milliseconds, the timings are
+        kept on the session and in startup_stats().
+        """
+        timings = {}
+        clock = [time.perf_counter()]
+        
+        def mark(phase):
+            now = time.perf_counter()
+            timings[phase] = round((now - clock[0]) * 1000, 1)
+            clock[0] = now
+        
+        def connect():
+            # Cached DNS, parallel connects to every resolved address, then auth
+            ssh = connect_ssh(hostname, port, username, password, private_key,
+                              connection_id=owner[1] if owner else None, timings=timings)
+            clock[0] = time.perf_counter()
+            return ssh
+        
+        lease = None
+        session = None
+        try:
+            pool_key = None
+            if owner:
+                pool_key = (owner[0], hostname, port, username, credential_fingerprint(password, private_key))
+            channel, lease = transport_pool.open_channel(pool_key, connect)
+            mark('channel')
             
             # Create interactive shell with PTY
-            transport = ssh.get_transport()
-            channel = transport.open_session()
             
             # Request PTY for interactive programs
             channel.get_pty(
@@ -56,112 +425,296 @@ class PersistentSSHManager:
                 width_pixels=0,
                 height_pixels=0
             )
+            mark('pty')
             
             # Invoke shell
             channel.invoke_shell()
+            mark('shell')
             
             # Set non-blocking
             channel.setblocking(0)
             
-            # Create output queue
-            output_queue = queue.Queue()
             
-            session_id = f"{hostname}:{port}:{username}:{int(time.time())}"
+            # Counter keeps ids unique when several sessions start in the same
+            # second, it also serves as the compact channel id on binary frames
+            channel_id = next(self._session_ids)
+            session_id = f"{hostname}:{port}:{username}:{int(time.time())}:{channel_id}"
             
+            session = SSHSession(session_id, channel_id, channel, lease, owner, timings)
             with self.lock:
-                self.sessions[session_id] = {
-                    'ssh': ssh,
-                    'channel': channel,
-                    'transport': transport,
-                    'output_queue': output_queue,
-                    'last_activity': time.time(),
-                    'is_alive': True
-                }
+                self._register(session)
+                self._schedule_expiry(session, session.last_activity + self.idle_timeout)
             
-            # Start background thread to read output
-            thread = threading.Thread(
-                target=self._read_output_thread,
-                args=(session_id,),
-                daemon=True
-            )
-            thread.start()
+            # Hand the channel to a reactor thread to read output
+            session.reactor = self._get_reactor()
+            session.reactor.add(session)
             
             logger.info(f"Created persistent SSH session: {session_id}")
             
-            # Wait for initial output (banner, motd, etc.)
-            time.sleep(0.5)
-            initial_output = self._get_output(session_id)
+            # Wait for initial output (banner, motd, etc.), later output is
+            # pushed or polled as usual
+            session.first_output.wait(Config.SSH_FIRST_OUTPUT_TIMEOUT)
+            mark('first_output')
+            initial_output = self._drain(session)[0]
+            
+            timings['total'] = round(sum(timings.values()), 1)
+            timings['pooled'] = 'ssh' not in timings
+            with self.lock:
+                self.start_timings.append(timings)
+            logger.info(f"Session start timings for {session_id}: {timings}")
             
             return {
                 'success': True,
                 'session_id': session_id,
-                'initial_output': initial_output
+                'channel_id': channel_id,
+                'initial_output': initial_output,
+                'timings': timings
             }
             
         except paramiko.AuthenticationException as e:
             return {'success': False, 'message': f'Authentication failed: {str(e)}'}
         except Exception as e:
+            # Channel setup failed, give the transport back to the pool
+            if lease and session is None:
+                channel.close()
+                transport_pool.release(lease)
             return {'success': False, 'message': f'Connection failed: {str(e)}'}
     
-    def _read_output_thread(self, session_id):
-        """Background thread to read output from SSH channel"""
-        while True:
-            with self.lock:
-                if session_id not in self.sessions:
-                    break
-                
-                session = self.sessions.get(session_id)
-                if not session or not session['is_alive']:
+    def _register(self, session):
+        """Add a session to the table and its indexes (lock held)"""
+        self.sessions[session.session_id] = session
+        if session.user_id is not None:
+            self.by_user.setdefault(session.user_id, set()).add(session.session_id)
+        if session.connection_id is not None:
+            self.by_connection.setdefault(session.connection_id, set()).add(session.session_id)
+    
+    def _unregister(self, session):
+        """Drop a session from the table and its indexes (lock held)"""
+        del self.sessions[session.session_id]
+        for index, key in ((self.by_user, session.user_id), (self.by_connection, session.connection_id)):
+            session_ids = index.get(key)
+            if session_ids is not None:
+                session_ids.discard(session.session_id)
+                if not session_ids:  # Clean up empty sets
+                    del index[key]
+    
+    def sessions_for_user(self, user_id):
+        """Ids of the sessions a user has open in this process"""
+        with self.lock:
+            return list(self.by_user.get(user_id, ()))
+    
+    def sessions_for_connection(self, connection_id):
+        """Ids of the sessions open on a saved connection in this process"""
+        with self.lock:
+            return list(self.by_connection.get(connection_id, ()))
+    
+    def _get_reactor(self):
+        """Pick the least loaded reactor, starting the pool on first use"""
+        with self.lock:
+            if not self.reactors:
+                for i in range(max(1, Config.SSH_REACTOR_THREADS)):
+                    self.reactors.append(SessionReactor(self, name=f'ssh-reactor-{i}'))
+            return min(self.reactors, key=len)
+    
+    def _read_channel(self, session):
+        """Drain a readable channel, returns False once the channel is finished"""
+        session_id = session.session_id
+        channel = session.channel
+        output_buffer = session.output_buffer
+        received = 0
+        paused = False
+        
+        try:
+            # Bounded batch so one busy session can't starve the others
+            for _ in range(16):
+                data = channel.recv(4096)
+                if not data:
+                    logger.info(f"SSH channel closed for session: {session_id}")
+                    session.is_alive = False
                     break
                 
-                channel = session['channel']
-                output_queue = session['output_queue']
-            
-            try:
-                # Check if data is available
-                ready = select.select([channel], [], [], 0.1)[0]
-                if ready:
-                    if channel.recv_ready():
-                        data = channel.recv(4096)
-                        if data:
-                            output_queue.put(data.decode('utf-8', errors='ignore'))
-                            with self.lock:
-                                if session_id in self.sessions:
-                                    self.sessions[session_id]['last_activity'] = time.time()
+                with self._flow_lock:
+                    if not session.is_alive:
+                        break
+                    session.scrollback.put(data)
+                    received += len(data)
+                    
+                    # Without a browser output only goes to scrollback
+                    if not session.attached:
+                        continue
+                    output_buffer.put(data)
+                    self.buffered_bytes += len(data)
                     
-                    # Check if channel is closed
-                    if channel.exit_status_ready():
-                        logger.info(f"SSH channel closed for session: {session_id}")
-                        with self.lock:
-                            if session_id in self.sessions:
-                                self.sessions[session_id]['is_alive'] = False
+                    # Stop reading, unread data stays in the channel window
+                    if self._over_limit(output_buffer):
+                        self._pause(session)
+                        paused = True
                         break
                 
-                # Small sleep to prevent CPU hogging
-                time.sleep(0.01)
-                
-            except Exception as e:
-                logger.error(f"Error reading from SSH channel {session_id}: {e}")
-                with self.lock:
-                    if session_id in self.sessions:
-                        self.sessions[session_id]['is_alive'] = False
-                break
+                if not channel.recv_ready():
+                    break
+        except socket.timeout:
+            # Non-blocking channel has nothing more right now
+            pass
+        except Exception as e:
+            logger.error(f"Error reading from SSH channel {session_id}: {e}")
+            session.is_alive = False
+        
+        if received:
+            session.last_activity = time.time()
+            session.first_output.set()
+            self._schedule_flush(session, received, flush_now=paused)
+        
+        return session.is_alive
+    
+    def _schedule_flush(self, session, received, flush_now=False):
+        """Deliver output now or within the flush window (reactor thread only)"""
+        if not session.push:
+            return
+        
+        now = time.monotonic()
+        interactive = (now - session.last_input <= self.interactive_window and
+                       received < self.interactive_bytes)
+        
+        if flush_now or interactive or session.output_buffer.queued >= self.flush_bytes:
+            session.flush_at = None
+            self._mark_ready(session)
+        elif session.flush_at is None:
+            session.flush_at = now + self.flush_delay
+            session.reactor.schedule_flush(session.flush_at, session)
+    
+    def detach_session(self, session_id):
+        """Keep a session running after its browser went away
+        
+        Undelivered output is dropped, the scrollback is replayed on reattach.
+        """
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if not session:
+                return False
+        
+        with self._flow_lock:
+            if not session.attached:
+                return False
+            session.attached = False
+            session.push = False
+            session.detached_at = time.time()
+            self.buffered_bytes -= len(session.output_buffer)
+            session.output_buffer.clear()
+            if self._paused:
+                self._resume_paused()
+        
+        with self.lock:
+            # A detached session may expire before its idle deadline
+            deadline = self._expiry_deadline(session)
+            if session_id in self.sessions and deadline < session.expires_at:
+                self._schedule_expiry(session, deadline)
+        
+        logger.info(f"Detached SSH session: {session_id}")
+        return True
+    
+    def find_detached(self, owner):
+        """Most recently detached live session of an owner"""
+        user_id, connection_id = owner
+        with self.lock:
+            candidates = (self.sessions[session_id] for session_id in self.by_connection.get(connection_id, ()))
+            detached = [(session.detached_at, session.session_id) for session in candidates
+                        if session.user_id == user_id and not session.attached and session.is_alive]
+        return max(detached)[1] if detached else None
+    
+    def close_detached(self, connection_id):
+        """Close the detached sessions of a saved connection, returns their ids"""
+        with self.lock:
+            candidates = [self.sessions[session_id] for session_id in self.by_connection.get(connection_id, ())]
+        
+        closed = [session.session_id for session in candidates if not session.attached]
+        for session_id in closed:
+            self.close_session(session_id)
+        return closed
+    
+    def reattach_session(self, session_id):
+        """Attach a browser to a detached session, queueing its scrollback for replay"""
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if not session or not session.is_alive:
+                return None
+        
+        with self._flow_lock:
+            if session.attached:
+                return None
+            session.attached = True
+            session.detached_at = None
+            
+            replay = session.scrollback.get()
+            session.output_buffer.put(replay)
+            self.buffered_bytes += len(replay)
+            session.decoder.reset()
+        
+        logger.info(f"Reattached SSH session: {session_id}")
+        return {
+            'success': True,
+            'session_id': session_id,
+            'channel_id': session.channel_id,
+            'initial_output': '',
+            'reattached': True
+        }
+    
+    def _over_limit(self, output_buffer):
+        """Check whether a session has to stop reading (flow lock held)"""
+        return (len(output_buffer) >= self.session_buffer_limit or
+                self.buffered_bytes >= self.global_buffer_limit)
+    
+    def _pause(self, session):
+        """Stop reading a session channel (flow lock held)"""
+        if session.paused:
+            return
+        session.paused = True
+        self._paused[session.session_id] = session
+        session.reactor.remove(session.channel)
+        logger.info(f"Output buffer full, pausing reads for session: {session.session_id}")
+    
+    def _resume_paused(self):
+        """Resume paused sessions that have room again (flow lock held)"""
+        for session_id, session in list(self._paused.items()):
+            buffered = len(session.output_buffer)
+            if buffered > self.session_buffer_limit // 2:
+                continue
+            # Over the global limit only sessions with nothing in flight may read
+            if buffered and self.buffered_bytes >= self.global_buffer_limit:
+                continue
+            
+            del self._paused[session_id]
+            session.paused = False
+            session.reactor.add(session)
+    
+    def ack_output(self, session_id, size):
+        """Release pushed output the browser has written"""
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if not session:
+                return False
+        
+        with self._flow_lock:
+            self.buffered_bytes -= session.output_buffer.ack(size)
+            if self._paused:
+                self._resume_paused()
+        return True
     
     def send_input(self, session_id, data):
         """Send input to SSH session"""
         with self.lock:
-            if session_id not in self.sessions:
+            session = self.sessions.get(session_id)
+            if not session:
                 return {'success': False, 'message': 'Session not found'}
             
-            session = self.sessions[session_id]
-            if not session['is_alive']:
+            if not session.is_alive:
                 return {'success': False, 'message': 'Session is closed'}
             
-            channel = session['channel']
+            channel = session.channel
         
         try:
-            # Handle special keys
-            if data == '\r' or data == '\n':
+            # Handle special keys, binary frames carry input as bytes
+            if data in ('\r', '\n', b'\r', b'\n'):
                 channel.send('\r')
             elif data == '\x03':  # Ctrl+C
                 channel.send('\x03')
@@ -182,7 +735,8 @@ class PersistentSSHManager:
             else:
                 channel.send(data)
             
-            session['last_activity'] = time.time()
+            session.last_activity = time.time()
+            session.last_input = time.monotonic()
             return {'success': True}
             
         except Exception as e:
@@ -192,29 +746,80 @@ class PersistentSSHManager:
     def get_output(self, session_id):
         """Get accumulated output from session"""
         with self.lock:
-            if session_id not in self.sessions:
+            session = self.sessions.get(session_id)
+            if not session:
                 return None
-            
-            session = self.sessions[session_id]
-            output_queue = session['output_queue']
         
-        # Get all available output
-        output = []
-        while True:
-            try:
-                output.append(output_queue.get_nowait())
-            except queue.Empty:
-                break
+        return self._drain(session)[0] or None
+    
+    def take_output(self, session_id):
+        """Take output for push delivery, returns (output, raw byte count)
+        
+        Output is text, or bytes for binary sessions.
+        """
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if not session:
+                return None, 0
+        
+        return self._drain(session, ack=not session.acks, decode=not session.binary)
+    
+    def get_channel_id(self, session_id):
+        """Compact channel id used on binary frames"""
+        with self.lock:
+            session = self.sessions.get(session_id)
+            return session.channel_id if session else None
+    
+    def compress_output(self, session_id, data):
+        """Deflate binary output for a session, returns None to send it as is"""
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if not session or not session.compressor:
+                return None
+        
+        return session.compressor.compress(data)
+    
+    def disable_compression(self, session_id, reason):
+        """Send the rest of a session's output uncompressed"""
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session and session.compressor:
+                session.compressor.disable(reason)
+                logger.info(f"Compression off for session {session_id}: {reason}")
+    
+    def compression_stats(self):
+        """Bandwidth saved and CPU spent compressing, per session"""
+        with self.lock:
+            return {session_id: session.compressor.stats()
+                    for session_id, session in self.sessions.items()
+                    if session.compressor}
+    
+    def startup_stats(self):
+        """Average milliseconds per start phase over recent session starts"""
+        with self.lock:
+            recent = list(self.start_timings)
+        
+        phases = {}
+        for timings in recent:
+            for phase, value in timings.items():
+                if phase != 'pooled':
+                    phases.setdefault(phase, []).append(value)
         
-        return ''.join(output) if output else None
+        return {
+            'starts': len(recent),
+            'pooled': sum(timings['pooled'] for timings in recent),
+            'average_ms': {phase: round(sum(values) / len(values), 1) for phase, values in phases.items()},
+            'last': recent[-1] if recent else None
+        }
     
     def resize_terminal(self, session_id, rows, cols):
         """Resize terminal window"""
         with self.lock:
-            if session_id not in self.sessions:
+            session = self.sessions.get(session_id)
+            if not session:
                 return False
             
-            channel = self.sessions[session_id]['channel']
+            channel = session.channel
         
         try:
             channel.resize_pty(width=cols, height=rows)
@@ -225,58 +830,90 @@ class PersistentSSHManager:
     def close_session(self, session_id):
         """Close SSH session"""
         with self.lock:
-            if session_id in self.sessions:
-                session = self.sessions[session_id]
-                session['is_alive'] = False
-                
-                try:
-                    # Send exit command and close
-                    session['channel'].send('exit\n')
-                    time.sleep(0.1)
-                    session['channel'].close()
-                    session['ssh'].close()
-                except:
-                    pass
-                
-                del self.sessions[session_id]
-                logger.info(f"Closed SSH session: {session_id}")
-                return True
+            session = self.sessions.get(session_id)
+            if not session:
+                return False
+            
+            # Release buffered output and stop watching the channel
+            # before its pipe is closed
+            with self._flow_lock:
+                session.is_alive = False
+                self._paused.pop(session_id, None)
+                self.buffered_bytes -= len(session.output_buffer)
+                session.output_buffer.clear()
+                if session.reactor:
+                    session.reactor.remove(session.channel)
+            self._unregister(session)
         
-        return False
+        # Closing can wait on the network, never under the lock
+        try:
+            # Send exit command and close
+            session.channel.send('exit\n')
+            session.channel.close()
+        except:
+            pass
+        transport_pool.release(session.lease)
+        
+        logger.info(f"Closed SSH session: {session_id}")
+        if session.compressor:
+            logger.info(f"Compression for {session_id}: {session.compressor.stats()}")
+        return True
+    
+    def _expiry_deadline(self, session):
+        """When a session may be closed, given its activity and detach time"""
+        deadline = session.last_activity + self.idle_timeout
+        if session.detached_at:
+            deadline = min(deadline, session.detached_at + self.detached_timeout)
+        return deadline
     
-    def cleanup_inactive(self, timeout_minutes=30):
-        """Clean up inactive sessions"""
-        current_time = time.time()
-        to_remove = []
+    def _schedule_expiry(self, session, deadline):
+        """Move a session's expiry to deadline, superseding its older entry (lock held)"""
+        session.expires_at = deadline
+        heapq.heappush(self._expiry, (deadline, session.session_id))
+    
+    def expired_sessions(self):
+        """Inactive sessions and detached ones nobody came back for
         
-        with self.lock:
-            for session_id, session in self.sessions.items():
-                inactive_time = current_time - session['last_activity']
-                if inactive_time > (timeout_minutes * 60):
-                    to_remove.append(session_id)
+        Only entries that are due are looked at. Returns the ids of the
+        sessions to close with close_session.
+        """
+        now = time.time()
+        expired = []
         
-        for session_id in to_remove:
-            self.close_session(session_id)
+        with self.lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                deadline, session_id = heapq.heappop(self._expiry)
+                session = self.sessions.get(session_id)
+                # Skip entries of closed sessions and ones that were rescheduled
+                if not session or session.expires_at != deadline:
+                    continue
+                
+                deadline = self._expiry_deadline(session)
+                if deadline <= now:
+                    expired.append(session_id)
+                else:
+                    # Active since the entry was pushed
+                    self._schedule_expiry(session, deadline)
         
-        return len(to_remove)
+        return expired
     
-    def _get_output(self, session_id):
-        """Helper method to get output (non-blocking)"""
-        with self.lock:
-            if session_id not in self.sessions:
-                return ''
-            
-            session = self.sessions[session_id]
-            output_queue = session['output_queue']
+    def _drain(self, session, ack=True, decode=True):
+        """Take all queued bytes and decode them in one pass"""
+        with self._flow_lock:
+            data = session.output_buffer.take(ack)
+            if ack and data:
+                self.buffered_bytes -= len(data)
+                if self._paused:
+                    self._resume_paused()
         
-        output = []
-        while True:
-            try:
-                output.append(output_queue.get_nowait())
-            except queue.Empty:
-                break
+        if not decode:
+            return data, len(data)
+        
+        if not data:
+            return '', 0
         
-        return ''.join(output)
+        # The session decoder keeps multibyte characters split across reads
+        return session.decoder.decode(data), len(data)
 
 # Global instance
 persistent_manager = PersistentSSHManager()
@@ -0,0 +1,214 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+from datetime import datetime
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Identifies this process in a shared registry
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+class MemorySessionRegistry:
+    """Live sessions of this process only, for a single worker"""
+
+    def __init__(self):
+        self.sessions = {}  # Format: {session_id: {"user_id": X, "connection_id": Y, "start_time": datetime, ...}}
+        self.user_sessions = {}  # Format: {user_id: set(session_ids)}
+        self.lock = threading.Lock()
+
+    def add(self, session_id, user_id, connection_id):
+        now = datetime.utcnow()
+        with self.lock:
+            self.sessions[session_id] = {
+                "user_id": user_id,
+                "connection_id": connection_id,
+                "start_time": now,
+                "last_activity": now,
+                "worker": WORKER_ID
+            }
+            self.user_sessions.setdefault(user_id, set()).add(session_id)
+
+    def touch(self, session_id):
+        with self.lock:
+            if session_id in self.sessions:
+                self.sessions[session_id]["last_activity"] = datetime.utcnow()
+
+    def remove(self, session_id):
+        """Forget a session, returns its user id or None if it wasn't registered"""
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+            if not session:
+                return None
+            user_id = session["user_id"]
+            sessions = self.user_sessions.get(user_id)
+            if sessions is not None:
+                sessions.discard(session_id)
+                if not sessions:  # Clean up empty sets
+                    del self.user_sessions[user_id]
+            return user_id
+
+    def count_for_user(self, user_id):
+        with self.lock:
+            return len(self.user_sessions.get(user_id, ()))
+
+    def sessions_for_user(self, user_id):
+        with self.lock:
+            return list(self.user_sessions.get(user_id, ()))
+
+    def all_sessions(self):
+        with self.lock:
+            return {session_id: dict(session) for session_id, session in self.sessions.items()}
+
+    def heartbeat(self):
+        """Nothing to report, there are no other workers"""
+        return []
+
+    def close(self):
+        pass
+
+class SQLiteSessionRegistry:
+    """Live sessions of every worker process in a shared SQLite file
+
+    Each worker records its own sessions tagged with its worker id, counts
+    and listings see all of them. Activity is written at most every
+    touch_interval seconds per session, keystrokes don't each become a write.
+    Workers heartbeat, sessions of a worker that stopped heartbeating (it
+    crashed or was killed) are dropped by whichever worker notices first.
+    """
+
+    def __init__(self, path, touch_interval, worker_timeout, busy_timeout_ms):
+        self.path = path
+        self.touch_interval = touch_interval
+        self.worker_timeout = worker_timeout
+        self.touched = {}  # Format: {session_id: monotonic time of the last activity write}
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(f'PRAGMA busy_timeout={int(busy_timeout_ms)}')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS live_sessions (
+                session_id TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                connection_id INTEGER,
+                worker TEXT NOT NULL,
+                start_time TEXT NOT NULL,
+                last_activity TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_live_sessions_user ON live_sessions (user_id);
+            CREATE INDEX IF NOT EXISTS ix_live_sessions_worker ON live_sessions (worker, last_activity);
+            CREATE TABLE IF NOT EXISTS live_workers (
+                worker TEXT PRIMARY KEY,
+                heartbeat REAL NOT NULL
+            );
+        ''')
+        self.heartbeat()
+
+    def add(self, session_id, user_id, connection_id):
+        now = datetime.utcnow().isoformat(' ')
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO live_sessions VALUES (?, ?, ?, ?, ?, ?)',
+                            (session_id, user_id, connection_id, WORKER_ID, now, now))
+            self.touched[session_id] = time.monotonic()
+
+    def touch(self, session_id):
+        now = time.monotonic()
+        with self.lock:
+            last = self.touched.get(session_id)
+            if last is not None and now - last < self.touch_interval:
+                return
+            self.touched[session_id] = now
+            self.db.execute('UPDATE live_sessions SET last_activity = ? WHERE session_id = ?',
+                            (datetime.utcnow().isoformat(' '), session_id))
+
+    def remove(self, session_id):
+        """Forget a session, returns its user id or None if it wasn't registered"""
+        with self.lock:
+            self.touched.pop(session_id, None)
+            row = self.db.execute('DELETE FROM live_sessions WHERE session_id = ? RETURNING user_id',
+                                  (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def count_for_user(self, user_id):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM live_sessions WHERE user_id = ?',
+                                   (user_id,)).fetchone()[0]
+
+    def sessions_for_user(self, user_id):
+        with self.lock:
+            return [session_id for session_id, in self.db.execute(
+                'SELECT session_id FROM live_sessions WHERE user_id = ?', (user_id,))]
+
+    def all_sessions(self):
+        with self.lock:
+            rows = self.db.execute('SELECT session_id, user_id, connection_id, worker, start_time, '
+                                   'last_activity FROM live_sessions').fetchall()
+        return {
+            session_id: {
+                "user_id": user_id,
+                "connection_id": connection_id,
+                "start_time": datetime.fromisoformat(start_time),
+                "last_activity": datetime.fromisoformat(last_activity),
+                "worker": worker
+            }
+            for session_id, user_id, connection_id, worker, start_time, last_activity in rows
+        }
+
+    def heartbeat(self):
+        """Mark this worker alive and drop sessions of dead workers
+
+        Returns the user ids whose session count changed.
+        """
+        now = time.time()
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                self.db.execute('INSERT OR REPLACE INTO live_workers VALUES (?, ?)', (WORKER_ID, now))
+                dead = [worker for worker, in self.db.execute(
+                    'SELECT worker FROM live_workers WHERE heartbeat < ?', (now - self.worker_timeout,))]
+                # Sessions whose worker never heartbeat at all, e.g. left by an older version
+                dead += [worker for worker, in self.db.execute(
+                    'SELECT DISTINCT worker FROM live_sessions WHERE worker NOT IN '
+                    '(SELECT worker FROM live_workers)')]
+                users = set()
+                for worker in dead:
+                    users.update(user_id for user_id, in self.db.execute(
+                        'DELETE FROM live_sessions WHERE worker = ? RETURNING user_id', (worker,)))
+                    self.db.execute('DELETE FROM live_workers WHERE worker = ?', (worker,))
+                self.db.execute('COMMIT')
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+
+        if dead:
+            logger.warning(f"Dropped live sessions of {len(dead)} stopped worker(s)")
+        return list(users)
+
+    def close(self):
+        """Remove this worker and its sessions, on shutdown"""
+        with self.lock:
+            self.db.execute('DELETE FROM live_sessions WHERE worker = ?', (WORKER_ID,))
+            self.db.execute('DELETE FROM live_workers WHERE worker = ?', (WORKER_ID,))
+
+def create_session_registry():
+    """Registry backend selected by SESSION_REGISTRY"""
+    if Config.SESSION_REGISTRY == 'sqlite':
+        return SQLiteSessionRegistry(
+            Config.SESSION_REGISTRY_PATH,
+            touch_interval=Config.SESSION_REGISTRY_TOUCH_SECONDS,
+            worker_timeout=Config.SESSION_REGISTRY_WORKER_TIMEOUT,
+            busy_timeout_ms=Config.DB_BUSY_TIMEOUT_MS
+        )
+    return MemorySessionRegistry()
+
+# Global instance
+session_registry = create_session_registry()
@@ -0,0 +1,196 @@
+import errno
+import os
+import paramiko
+import selectors
+import socket
+import threading
+import time
+import logging
+from config import Config
+from ssh_keys import key_loader
+
+logger = logging.getLogger(__name__)
+
+class ResolverCache:
+    """getaddrinfo results cached per (host, port) for a short TTL"""
+
+    def __init__(self, ttl, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = {}  # Format: {(host, port): (expires_at, addrinfos)}
+        self.lock = threading.Lock()
+
+    def resolve(self, host, port):
+        key = (host, port)
+        now = time.monotonic()
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached and cached[0] > now:
+                return cached[1]
+
+        addrinfos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+
+        with self.lock:
+            self.entries.pop(key, None)
+            if len(self.entries) >= self.max_entries:
+                # Oldest insertion first
+                del self.entries[next(iter(self.entries))]
+            self.entries[key] = (now + self.ttl, addrinfos)
+        return addrinfos
+
+def interleave_families(addrinfos):
+    """Alternate address families, keeping the resolver's preferred family first"""
+    families = {}
+    for addrinfo in addrinfos:
+        families.setdefault(addrinfo[0], []).append(addrinfo)
+
+    ordered = []
+    queues = list(families.values())
+    while queues:
+        for queue in queues:
+            ordered.append(queue.pop(0))
+        queues = [queue for queue in queues if queue]
+    return ordered
+
+def happy_eyeballs_connect(addrinfos, timeout, delay):
+    """Connect to whichever address answers first (RFC 8305 style)
+
+    The next address is tried every delay seconds, or right away when an
+    attempt fails, while earlier attempts keep running. Returns a connected
+    blocking socket, the other attempts are closed.
+    """
+    remaining = interleave_families(addrinfos)
+    selector = selectors.DefaultSelector()
+    deadline = time.monotonic() + timeout
+    error = None
+
+    try:
+        while True:
+            if remaining:
+                family, socktype, proto, _, address = remaining.pop(0)
+                sock = socket.socket(family, socktype, proto)
+                sock.setblocking(False)
+                result = sock.connect_ex(address)
+                if result in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    selector.register(sock, selectors.EVENT_WRITE, address)
+                else:
+                    error = OSError(result, os.strerror(result))
+                    sock.close()
+                    continue
+
+            if not selector.get_map():
+                raise error or OSError('No addresses to connect to')
+
+            now = time.monotonic()
+            if now >= deadline:
+                raise socket.timeout('timed out')
+            wait = min(delay, deadline - now) if remaining else deadline - now
+
+            for key, _ in selector.select(wait):
+                sock = key.fileobj
+                selector.unregister(sock)
+                result = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if result == 0:
+                    sock.setblocking(True)
+                    sock.settimeout(timeout)
+                    return sock
+                error = OSError(result, os.strerror(result))
+                sock.close()
+    finally:
+        # Attempts that lost the race
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        selector.close()
+
+def open_ssh_socket(hostname, port, timeout, timings=None):
+    """Resolve and connect a TCP socket for an SSH transport
+
+    Records resolve and tcp phases in milliseconds into timings if given.
+    """
+    started = time.perf_counter()
+    addrinfos = resolver_cache.resolve(hostname, port)
+    resolved = time.perf_counter()
+    sock = happy_eyeballs_connect(addrinfos, timeout, Config.SSH_CONNECT_ATTEMPT_DELAY_MS / 1000)
+
+    if timings is not None:
+        timings['resolve'] = round((resolved - started) * 1000, 1)
+        timings['tcp'] = round((time.perf_counter() - resolved) * 1000, 1)
+    return sock
+
+class DeadlineTransport(paramiko.Transport):
+    """Transport whose auth attempts only get the time left until a deadline"""
+
+    deadline = None  # time.monotonic() based
+
+    @property
+    def auth_timeout(self):
+        if self.deadline is None:
+            return self._auth_timeout
+        return max(0, self.deadline - time.monotonic())
+
+    @auth_timeout.setter
+    def auth_timeout(self, value):
+        self._auth_timeout = value
+
+def remaining_time(deadline):
+    """Seconds left until a time.monotonic() deadline, raises once it passed"""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise socket.timeout('timed out')
+    return remaining
+
+def connect_ssh(hostname, port, username, password=None, private_key=None, connection_id=None,
+                timeout=10, timings=None):
+    """Open an authenticated paramiko.SSHClient, used by every SSH entry point
+
+    Connects through the resolver cache and happy eyeballs, then logs in with
+    the private key (any type) if given, the password otherwise. timeout
+    bounds the whole connect, each phase only gets the time the earlier ones
+    left. Records resolve, tcp and ssh phases in milliseconds into timings
+    if given.
+    """
+    deadline = time.monotonic() + timeout
+    sock = open_ssh_socket(hostname, port, timeout, timings=timings)
+    started = time.perf_counter()
+
+    def transport_factory(sock, **kwargs):
+        transport = DeadlineTransport(sock, **kwargs)
+        transport.deadline = deadline
+        return transport
+
+    ssh = paramiko.SSHClient()
+    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    try:
+        if private_key:
+            # Key-based authentication
+            credentials = {'pkey': key_loader.load(private_key, connection_id=connection_id)}
+        else:
+            # Password authentication
+            credentials = {'password': password}
+        remaining = remaining_time(deadline)
+        # Banner and key exchange share the timeout, auth gets what they leave
+        ssh.connect(
+            hostname=hostname,
+            port=port,
+            username=username,
+            sock=sock,
+            timeout=remaining,
+            banner_timeout=remaining,
+            transport_factory=transport_factory,
+            **credentials
+        )
+    except Exception as e:
+        ssh.close()
+        sock.close()
+        if time.monotonic() >= deadline:
+            # paramiko reports running out of auth time as a failed login
+            raise socket.timeout('timed out') from e
+        raise
+
+    if timings is not None:
+        # Banner, key exchange and auth
+        timings['ssh'] = round((time.perf_counter() - started) * 1000, 1)
+    return ssh
+
+# Global instance
+resolver_cache = ResolverCache(Config.SSH_DNS_CACHE_SECONDS)
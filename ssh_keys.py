@@ -0,0 +1,102 @@
+import paramiko
+import base64
+import collections
+import hashlib
+import threading
+import logging
+from io import StringIO
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# PEM header -> key class, OpenSSH format keys name their type inside the blob
+PEM_KEY_TYPES = {
+    'RSA PRIVATE KEY': paramiko.RSAKey,
+    'EC PRIVATE KEY': paramiko.ECDSAKey,
+    'DSA PRIVATE KEY': paramiko.DSSKey,
+}
+OPENSSH_KEY_TYPES = [
+    (b'ssh-ed25519', paramiko.Ed25519Key),
+    (b'ecdsa-sha2-', paramiko.ECDSAKey),
+    (b'ssh-rsa', paramiko.RSAKey),
+    (b'ssh-dss', paramiko.DSSKey),
+]
+
+class PrivateKeyLoader:
+    """Parse private keys of any type once and keep the key objects
+
+    Parsing (and for encrypted keys the passphrase KDF) happens once per
+    (connection id, key hash), the parsed key is reused by every connect.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.keys = collections.OrderedDict()  # Format: {(connection_id, key_hash): PKey}
+        self.lock = threading.Lock()
+
+    def load(self, private_key, connection_id=None, passphrase=None):
+        """Parsed key for a PEM or OpenSSH private key text"""
+        key_hash = hashlib.sha256(private_key.encode()).hexdigest()
+        cache_key = (connection_id, key_hash)
+
+        with self.lock:
+            pkey = self.keys.get(cache_key)
+            if pkey is not None:
+                self.keys.move_to_end(cache_key)
+                return pkey
+
+        pkey = self._parse(private_key, passphrase)
+
+        with self.lock:
+            self.keys[cache_key] = pkey
+            self.keys.move_to_end(cache_key)
+            while len(self.keys) > self.max_entries:
+                self.keys.popitem(last=False)
+        return pkey
+
+    def evict(self, connection_id):
+        """Forget the parsed keys of a connection, e.g. after it was edited"""
+        with self.lock:
+            for cache_key in [cache_key for cache_key in self.keys if cache_key[0] == connection_id]:
+                del self.keys[cache_key]
+
+    def _parse(self, private_key, passphrase):
+        key_class = self._detect(private_key)
+        candidates = [key_class] if key_class else []
+        # Unknown or mislabelled keys, try every type
+        candidates += [cls for cls in (paramiko.Ed25519Key, paramiko.ECDSAKey,
+                                       paramiko.RSAKey, paramiko.DSSKey) if cls is not key_class]
+
+        error = None
+        for cls in candidates:
+            try:
+                return cls.from_private_key(StringIO(private_key), password=passphrase)
+            except paramiko.PasswordRequiredException:
+                raise
+            except (paramiko.SSHException, ValueError) as e:
+                error = e
+        raise paramiko.SSHException(f'Unsupported or invalid private key: {error}')
+
+    def _detect(self, private_key):
+        """Key class named by the key text, None if it can't tell"""
+        lines = private_key.strip().splitlines()
+        if not lines or not lines[0].startswith('-----BEGIN '):
+            return None
+
+        label = lines[0][len('-----BEGIN '):].rstrip('-').strip()
+        if label != 'OPENSSH PRIVATE KEY':
+            return PEM_KEY_TYPES.get(label)
+
+        # The public key part of the blob is never encrypted
+        try:
+            blob = base64.b64decode(''.join(line for line in lines[1:] if not line.startswith('-----')))
+        except ValueError:
+            return None
+        head = blob[:256]
+        for marker, key_class in OPENSSH_KEY_TYPES:
+            if marker in head:
+                return key_class
+        return None
+
+# Global instance
+key_loader = PrivateKeyLoader(Config.SSH_KEY_CACHE_SIZE)
@@ -1,235 +1,213 @@
-import paramiko
+import collections
+import hashlib
+import secrets
 import threading
 import time
-import select
-from io import StringIO
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet
+from datetime import datetime
+from config import Config
 import os
 import base64
 
+class CredentialCache:
+    """Decrypted passwords per connection, bounded and short lived
+    
+    An entry only answers for the ciphertext it was decrypted from, so a
+    changed password never returns the old secret.
+    """
+    
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()  # Format: {connection_id: (ciphertext, password, expires_at)}
+        self.lock = threading.Lock()
+    
+    def get(self, connection_id, ciphertext):
+        """Cached password, None on a miss"""
+        with self.lock:
+            entry = self.entries.get(connection_id)
+            if not entry:
+                return None
+            if entry[0] != ciphertext or entry[2] < time.monotonic():
+                del self.entries[connection_id]
+                return None
+            self.entries.move_to_end(connection_id)
+            return entry[1]
+    
+    def put(self, connection_id, ciphertext, password):
+        with self.lock:
+            self.entries[connection_id] = (ciphertext, password, time.monotonic() + self.ttl)
+            self.entries.move_to_end(connection_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def invalidate(self, connection_id):
+        with self.lock:
+            self.entries.pop(connection_id, None)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
 class SSHManager:
-    """Manage SSH connections and operations"""
+    """Encrypt stored SSH passwords and cache decrypted ones
+    
+    Live shell sessions are managed by persistent_ssh.
+    """
     
     def __init__(self):
-        self.connections = {}
-        
         # Gunakan FIXED encryption key yang sama setiap kali
         # JANGAN generate key baru setiap kali aplikasi dijalankan!
-        self.key = self.get_or_create_encryption_key()
-        self.cipher = Fernet(self.key)
+        # The key file is a keyring, the first key encrypts and every key
+        # decrypts, so keys can be rotated without losing stored passwords
+        self.key_file = 'encryption_key.key'
+        self.key_file_mtime = None
+        self.credentials = CredentialCache(Config.SSH_CREDENTIAL_CACHE_SECONDS,
+                                           Config.SSH_CREDENTIAL_CACHE_SIZE)
+        self.load_keys()
     
-    def get_or_create_encryption_key(self):
-        """Get existing encryption key or create one and save it"""
-        key_file = 'encryption_key.key'
+    def load_keys(self):
+        """(Re)load the keyring from the key file"""
+        keys = self.get_or_create_encryption_keys()
+        self.keys = collections.OrderedDict((key_id, Fernet(key)) for key_id, key in keys)
+        self.primary_key_id = keys[0][0]
+        self.cipher = self.keys[self.primary_key_id]
+        # Tokens from before key ids were stored could be from any key
+        self.legacy_cipher = MultiFernet(list(self.keys.values()))
+        self.key_file_mtime = os.path.getmtime(self.key_file)
+        
+        # Stored with password checks so they are redone after the keyring changes
+        self.key_fingerprint = hashlib.sha256(','.join(sorted(self.keys)).encode()).hexdigest()[:16]
+        
+        # Cached passwords were decrypted with the old keyring
+        self.credentials.clear()
+    
+    def reload_keys_if_changed(self):
+        """Pick up a key added to the key file while running"""
+        try:
+            if os.path.getmtime(self.key_file) != self.key_file_mtime:
+                self.load_keys()
+                print(f"✓ Reloaded encryption keys, primary key is {self.primary_key_id}")
+        except Exception as e:
+            print(f"Error reloading encryption keys: {e}")
+    
+    def get_or_create_encryption_keys(self):
+        """Get the keyring, creating it with one key if there is none
+        
+        One key per line as "<key id> <key>", newest first. A bare key (the
+        old single-key format) gets an id derived from the key itself.
+        """
+        key_file = self.key_file
         
         # Jika file key sudah ada, baca dari file
         if os.path.exists(key_file):
+            keys = []
             with open(key_file, 'rb') as f:
-                key = f.read()
-            print(f"✓ Loaded encryption key from {key_file}")
-            return key
+                for line in f.read().decode().splitlines():
+                    parts = line.split()
+                    if not parts or parts[0].startswith('#'):
+                        continue
+                    if len(parts) == 1:
+                        parts = ['k' + hashlib.sha256(parts[0].encode()).hexdigest()[:8], parts[0]]
+                    keys.append((parts[0], parts[1].encode()))
+            if keys:
+                print(f"✓ Loaded {len(keys)} encryption key(s) from {key_file}, primary key is {keys[0][0]}")
+                return keys
         
         # Jika tidak ada, generate key baru dan simpan ke file
         print(f"⚠ No encryption key found. Creating new one at {key_file}")
-        key = Fernet.generate_key()
+        self.add_encryption_key()
+        print("✓ New encryption key created and saved")
+        return self.get_or_create_encryption_keys()
+    
+    def add_encryption_key(self):
+        """Put a new key in front of the keyring, returns its id
+        
+        Running servers pick it up for new passwords, existing ones are moved
+        over by the re-encryption job.
+        """
+        key = Fernet.generate_key().decode()
+        
+        existing = ''
+        if os.path.exists(self.key_file):
+            with open(self.key_file, 'rb') as f:
+                existing = f.read().decode()
+        
+        # Keys added within the same second still get their own id
+        taken = {line.split()[0] for line in existing.splitlines() if line.strip()}
+        key_id = None
+        while key_id is None or key_id in taken:
+            key_id = datetime.utcnow().strftime('k%Y%m%d%H%M%S') + '-' + secrets.token_hex(2)
         
-        with open(key_file, 'wb') as f:
-            f.write(key)
+        with open(self.key_file, 'wb') as f:
+            f.write(f"{key_id} {key}\n{existing}".encode())
         
         # Set permissions agar hanya owner yang bisa baca
         try:
-            os.chmod(key_file, 0o600)
+            os.chmod(self.key_file, 0o600)
         except:
             pass
         
-        print("✓ New encryption key created and saved")
-        return key
+        return key_id
     
     def encrypt_password(self, password):
-        """Encrypt password for storage"""
+        """Encrypt password for storage, prefixed with the id of the key used"""
         if not password:
             return ''
+        self.reload_keys_if_changed()
         try:
-            return self.cipher.encrypt(password.encode()).decode()
+            return f"{self.primary_key_id}:{self.cipher.encrypt(password.encode()).decode()}"
         except Exception as e:
             print(f"Error encrypting password: {e}")
             return ''
     
-    def decrypt_password(self, encrypted_password):
-        """Decrypt password for use"""
+    def decrypt_password(self, encrypted_password, connection_id=None):
+        """Decrypt password for use, cached per connection when its id is given"""
         if not encrypted_password:
             return ''
         
+        if connection_id is not None:
+            cached = self.credentials.get(connection_id, encrypted_password)
+            if cached is not None:
+                return cached
+        
         try:
-            return self.cipher.decrypt(encrypted_password.encode()).decode()
+            password = self._decrypt(encrypted_password)
         except Exception as e:
             print(f"⚠ WARNING: Failed to decrypt password. It may have been encrypted with a different key.")
             print(f"Error: {e}")
             
-            # Fallback: return empty string
+            # Fallback: return empty string, not cached so a key added
+            # to the key file later is picked up
             return ''
-    
-    def connect(self, hostname, port, username, password, private_key=None):
-        """Establish SSH connection"""
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         
-        try:
-            if private_key:
-                # Key-based authentication
-                key_file = StringIO(private_key)
-                private_key_obj = paramiko.RSAKey.from_private_key(key_file)
-                ssh.connect(
-                    hostname=hostname,
-                    port=port,
-                    username=username,
-                    pkey=private_key_obj,
-                    timeout=10,
-                    banner_timeout=10
-                )
-            else:
-                # Password authentication
-                ssh.connect(
-                    hostname=hostname,
-                    port=port,
-                    username=username,
-                    password=password,
-                    timeout=10,
-                    banner_timeout=10
-                )
-            
-            # Untuk testing, buka session bukan shell
-            transport = ssh.get_transport()
-            channel = transport.open_session()
-            channel.get_pty(term='xterm')
-            channel.invoke_shell()
-            channel.setblocking(0)
-            
-            connection_id = f"{hostname}_{port}_{username}_{int(time.time())}"
-            self.connections[connection_id] = {
-                'ssh': ssh,
-                'channel': channel,
-                'hostname': hostname,
-                'username': username
-            }
-            
-            # Tunggu sebentar untuk initial output
-            import eventlet
-            eventlet.sleep(0.5)
-            
-            return {'success': True, 'connection_id': connection_id}
-            
-        except paramiko.AuthenticationException:
-            return {'success': False, 'message': 'Authentication failed'}
-        except Exception as e:
-            return {'success': False, 'message': str(e)}
-    
-    def execute_command(self, connection_id, command):
-        """Execute command on SSH connection"""
-        if connection_id not in self.connections:
-            return {'success': False, 'message': 'Connection not found'}
-        
-        try:
-            ssh = self.connections[connection_id]['ssh']
-            stdin, stdout, stderr = ssh.exec_command(command, get_pty=True)
-            
-            # Baca output dengan timeout
-            import select
-            import time
-            
-            output = ''
-            error = ''
-            max_wait = 10
-            
-            start_time = time.time()
-            while True:
-                if stdout.channel.recv_ready():
-                    output += stdout.channel.recv(4096).decode('utf-8', errors='ignore')
-                
-                if stderr.channel.recv_stderr_ready():
-                    error += stderr.channel.recv_stderr(4096).decode('utf-8', errors='ignore')
-                
-                if stdout.channel.exit_status_ready():
-                    break
-                
-                if time.time() - start_time > max_wait:
-                    break
-                
-                time.sleep(0.1)
-            
-            return {
-                'success': True,
-                'output': output,
-                'error': error
-            }
-            
-        except Exception as e:
-            return {'success': False, 'message': str(e)}
+        if connection_id is not None:
+            self.credentials.put(connection_id, encrypted_password, password)
+        return password
     
-    def read_output(self, connection_id):
-        """Read output from shell channel"""
-        if connection_id not in self.connections:
-            return None
-        
-        channel = self.connections[connection_id]['channel']
+    def _decrypt(self, encrypted_password):
+        key_id, separator, token = encrypted_password.partition(':')
+        if not separator:
+            return self.legacy_cipher.decrypt(encrypted_password.encode()).decode()
         
-        output = ''
-        try:
-            if channel.recv_ready():
-                while True:
-                    try:
-                        ready = select.select([channel], [], [], 0.1)[0]
-                        if ready:
-                            data = channel.recv(4096)
-                            if data:
-                                output += data.decode('utf-8', errors='ignore')
-                            else:
-                                break
-                        else:
-                            break
-                    except:
-                        break
-        except:
-            pass
-        
-        return output if output else None
+        if key_id not in self.keys:
+            self.reload_keys_if_changed()
+        cipher = self.keys.get(key_id)
+        if cipher is None:
+            raise ValueError(f"Encryption key {key_id} is not in {self.key_file}")
+        return cipher.decrypt(token.encode()).decode()
     
-    def send_input(self, connection_id, data):
-        """Send input to shell channel"""
-        if connection_id not in self.connections:
-            return False
-        
-        try:
-            channel = self.connections[connection_id]['channel']
-            channel.send(data)
-            return True
-        except:
-            return False
+    def needs_reencrypt(self, encrypted_password):
+        """Whether a stored password is not encrypted with the primary key"""
+        return bool(encrypted_password) and not encrypted_password.startswith(f"{self.primary_key_id}:")
     
-    def resize_terminal(self, connection_id, rows, cols):
-        """Resize terminal window"""
-        if connection_id not in self.connections:
-            return False
-        
+    def reencrypt_password(self, encrypted_password):
+        """Stored password re-encrypted with the primary key, None if it can't be decrypted"""
         try:
-            channel = self.connections[connection_id]['channel']
-            channel.resize_pty(width=cols, height=rows)
-            return True
-        except:
-            return False
-    
-    def disconnect(self, connection_id):
-        """Close SSH connection"""
-        if connection_id in self.connections:
-            try:
-                self.connections[connection_id]['channel'].close()
-                self.connections[connection_id]['ssh'].close()
-            except:
-                pass
-            finally:
-                del self.connections[connection_id]
-        
-        return True
+            password = self._decrypt(encrypted_password)
+        except Exception:
+            return None
+        return f"{self.primary_key_id}:{self.cipher.encrypt(password.encode()).decode()}"
 
 # Global SSH manager instance
 ssh_manager = SSHManager()
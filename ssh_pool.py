@@ -0,0 +1,266 @@
+import hashlib
+import paramiko
+import threading
+import time
+import logging
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+def credential_fingerprint(password, private_key):
+    """Short hash of the credentials a transport authenticates with, part of the pool key"""
+    secret = f"{password or ''}\0{private_key or ''}".encode()
+    return hashlib.sha256(secret).hexdigest()[:16]
+
+class TransportPool:
+    """Authenticated SSH transports shared by sessions to the same account
+
+    Works like OpenSSH ControlMaster: another session to a host the user is
+    already connected to is opened as a new channel on the existing
+    transport instead of a new TCP connection, key exchange and auth.
+    Keys include a credential fingerprint, so a transport is only reused by
+    callers holding the credentials it was authenticated with.
+    Transports are reference counted and closed after being idle for a while.
+    At most max_transports are kept, beyond that the longest idle one is
+    evicted or the new transport is closed once its channels are done.
+    """
+
+    def __init__(self, idle_timeout, max_transports, channel_timeout, keepalive):
+        self.idle_timeout = idle_timeout
+        self.max_transports = max_transports
+        self.channel_timeout = channel_timeout
+        self.keepalive = keepalive
+        self.entries = {}  # Format: {(user_id, hostname, port, username, credentials): [entry, ...]}
+        self.connecting = {}  # Format: {key: threading.Event} while a transport is being opened
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def open_channel(self, key, connect, deadline=None, wait=True):
+        """Open a session channel for key, returns (channel, lease)
+
+        connect() must return a connected paramiko.SSHClient, it is only
+        called when no pooled transport can take another channel. With key
+        None the connection is not shared. Pass the lease to release() once
+        the channel is closed. With a deadline (time.time() based) waiting
+        for a transport and opening the channel only get the time left until
+        it. With wait False returns None instead of waiting for another
+        caller that is opening the transport for key.
+        """
+        self.evict_idle()
+
+        while key is not None:
+            with self.lock:
+                entry = next((entry for entry in self.entries.get(key, [])
+                              if not entry['full'] and self._healthy(entry)), None)
+                if entry is None:
+                    connecting = self.connecting.get(key)
+                    if connecting is None:
+                        # This caller opens the transport, others wait for it
+                        self.connecting[key] = threading.Event()
+                        break
+                else:
+                    self._ref(entry)
+
+            if entry is None:
+                if not wait:
+                    return None
+                # Sessions started together share the transport one of them opens
+                connecting.wait(self._timeout(deadline))
+                continue
+
+            # Opening the channel is a round trip, so it doubles as the health check
+            try:
+                channel = entry['transport'].open_session(timeout=self._timeout(deadline))
+                with self.lock:
+                    self.hits += 1
+                logger.debug(f"Reusing pooled SSH transport for {key[1]}:{key[2]}")
+                return channel, entry
+            except paramiko.ChannelException as e:
+                # Server's MaxSessions limit, try another transport
+                logger.debug(f"Pooled SSH transport refused a channel: {e}")
+                with self.lock:
+                    entry['full'] = True
+                    self._unref(entry)
+            except Exception as e:
+                if deadline is not None and time.time() >= deadline:
+                    # Out of time, the transport may well be fine
+                    with self.lock:
+                        self._unref(entry)
+                    raise TimeoutError('Timed out opening an SSH channel')
+                # Dead or stuck transport, never hand it out again
+                logger.warning(f"Pooled SSH transport for {key[1]}:{key[2]} failed: {e}")
+                with self.lock:
+                    entry['broken'] = True
+                    self._unref(entry)
+
+        try:
+            client = connect()
+            transport = client.get_transport()
+            try:
+                channel = transport.open_session(timeout=self._timeout(deadline))
+            except Exception:
+                client.close()
+                raise
+        except Exception:
+            self._connected(key)
+            raise
+
+        entry = {
+            'key': key,
+            'client': client,
+            'transport': transport,
+            'refs': 1,
+            'full': False,
+            'broken': False,
+            'idle_since': None
+        }
+        if key is not None:
+            transport.set_keepalive(self.keepalive)
+            with self.lock:
+                self.misses += 1
+                if self._make_room():
+                    self.entries.setdefault(key, []).append(entry)
+                else:
+                    # Pool is full of busy transports, this one is not shared
+                    entry['key'] = None
+            self._connected(key)
+        return channel, entry
+
+    def release(self, lease):
+        """Give back a channel opened with open_channel"""
+        with self.lock:
+            # A channel slot is free again
+            lease['full'] = False
+            self._unref(lease)
+            close = lease['key'] is None and lease['refs'] == 0
+
+        if close:
+            lease['client'].close()
+
+    def evict_idle(self):
+        """Close transports without channels that have been idle too long or died"""
+        now = time.monotonic()
+
+        with self.lock:
+            expired = [entry for entries in self.entries.values() for entry in entries
+                       if entry['refs'] == 0 and (now - entry['idle_since'] > self.idle_timeout or
+                                                  not self._healthy(entry))]
+            for entry in expired:
+                self._remove(entry)
+
+        self._close(expired)
+        if expired:
+            logger.info(f"Closed {len(expired)} idle pooled SSH transports")
+        return len(expired)
+
+    def evict_account(self, user_id, hostname, port, username):
+        """Stop sharing the transports of an account whose credentials changed
+        
+        Idle transports are closed now, busy ones once their channels are released.
+        """
+        account = (user_id, hostname, int(port), username)
+
+        with self.lock:
+            evicted = [entry for key, entries in self.entries.items() if key[:4] == account
+                       for entry in entries]
+            for entry in evicted:
+                self._remove(entry)
+            idle = [entry for entry in evicted if entry['refs'] == 0]
+
+        if idle:
+            # Closing can block on the socket, don't do it on the caller
+            threading.Thread(target=self._close, args=(idle,), daemon=True).start()
+        return len(evicted)
+
+    def stats(self):
+        """Pool statistics for debugging"""
+        with self.lock:
+            entries = [entry for entries in self.entries.values() for entry in entries]
+            lookups = self.hits + self.misses
+            return {
+                'transports': len(entries),
+                'max_transports': self.max_transports,
+                'channels': sum(entry['refs'] for entry in entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else 0,
+                'evictions': self.evictions
+            }
+
+    def is_connecting(self, key):
+        """Whether a caller is opening the transport for key"""
+        with self.lock:
+            return key in self.connecting
+
+    def _timeout(self, deadline):
+        """Channel timeout, cut short by a caller's deadline"""
+        if deadline is None:
+            return self.channel_timeout
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise TimeoutError('Timed out opening an SSH channel')
+        return min(self.channel_timeout, remaining)
+
+    def _connected(self, key):
+        """Wake callers waiting for the transport of key"""
+        if key is None:
+            return
+        with self.lock:
+            connecting = self.connecting.pop(key, None)
+        if connecting:
+            connecting.set()
+
+    def _healthy(self, entry):
+        transport = entry['transport']
+        return not entry['broken'] and transport.is_active() and transport.is_authenticated()
+
+    def _make_room(self):
+        """Evict the longest idle transport if the pool is full, caller holds the lock"""
+        entries = [entry for entries in self.entries.values() for entry in entries]
+        if len(entries) < self.max_transports:
+            return True
+
+        idle = [entry for entry in entries if entry['refs'] == 0]
+        if not idle:
+            return False
+
+        oldest = min(idle, key=lambda entry: entry['idle_since'])
+        self._remove(oldest)
+        # Closing can block on the socket, don't do it under the lock
+        threading.Thread(target=self._close, args=([oldest],), daemon=True).start()
+        return True
+
+    def _remove(self, entry):
+        entries = self.entries[entry['key']]
+        entries.remove(entry)
+        if not entries:
+            del self.entries[entry['key']]
+        # Whoever still holds a channel closes the transport on release
+        entry['key'] = None
+        self.evictions += 1
+
+    def _close(self, entries):
+        for entry in entries:
+            try:
+                entry['client'].close()
+            except:
+                pass
+
+    def _ref(self, entry):
+        entry['refs'] += 1
+        entry['idle_since'] = None
+
+    def _unref(self, entry):
+        entry['refs'] -= 1
+        if entry['refs'] == 0:
+            entry['idle_since'] = time.monotonic()
+
+# Global instance
+transport_pool = TransportPool(
+    idle_timeout=Config.SSH_POOL_IDLE_SECONDS,
+    max_transports=Config.SSH_POOL_MAX_TRANSPORTS,
+    channel_timeout=Config.SSH_POOL_CHANNEL_TIMEOUT,
+    keepalive=Config.SSH_POOL_KEEPALIVE_SECONDS
+)
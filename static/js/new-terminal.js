@@ -3,11 +3,33 @@ let socket = null;
 let fitAddon = null;
 let webglAddon = null;
 let currentSessionId = null;
+let currentChannel = null;
+let binaryFrames = false;
 let isConnected = false;
 let outputPollingInterval = null;
 let sessionStartTime = null;
 let bytesSent = 0;
 let bytesReceived = 0;
+let pendingAckBytes = 0;
+let ackTimer = null;
+
+// Acknowledge written output in batches so the server can keep reading
+const ACK_BATCH_BYTES = 64 * 1024;
+const ACK_DELAY_MS = 100;
+
+// Binary data frames: 4-byte channel id followed by the raw payload
+const FRAME_HEADER_BYTES = 4;
+const ZFRAME_HEADER_BYTES = 8;
+const textEncoder = new TextEncoder();
+
+// Compressed output: one inflate stream per session, frames are written in order
+let inflateWriter = null;
+let inflatePendingBytes = 0;
+let outputQueue = [];
+let inflateSupported = supportsDeflateRaw();
+
+// Sessions survive reloads and dropped sockets, the server keeps them detached for a while
+const ATTACHED_KEY_PREFIX = 'ssh_attached_';
 
 // Terminal themes
 const themes = {
@@ -103,10 +125,7 @@ function initTerminal() {
     term.onData(data => {
         if (isConnected && socket && currentSessionId) {
             // Send input to persistent SSH session
-            socket.emit('persistent_ssh_input', {
-                session_id: currentSessionId,
-                data: data
-            });
+            sendInput(data);
 
             // Update bytes sent
             bytesSent += data.length;
@@ -207,27 +226,49 @@ function initSocket() {
     socket.on('connect', () => {
         console.log('WebSocket connected');
         updateStatus('Ready to connect', 'disconnected');
+
+        // Reattach to the session this tab was using before the reload or reconnect
+        if (!currentSessionId && sessionStorage.getItem(attachedSessionKey())) {
+            connectSSH();
+        }
     });
 
     socket.on('ssh_session_started', (data) => {
         console.log('Persistent SSH session started:', data);
         currentSessionId = data.session_id;
+        currentChannel = data.channel;
+        binaryFrames = !!data.binary;
+        if (data.compression === 'deflate' && !startInflate()) {
+            // Output can't be inflated here after all, reattach without compression to get it replayed
+            inflateSupported = false;
+            sessionStorage.setItem(attachedSessionKey(), data.session_id);
+            socket.disconnect().connect();
+            return;
+        }
         isConnected = true;
         sessionStartTime = new Date();
+        sessionStorage.setItem(attachedSessionKey(), data.session_id);
 
         updateStatus('Connected to SSH', 'connected');
-        term.clear();
-        term.writeln('\x1b[1;32m✓ SSH session established\x1b[0m');
-        term.writeln('\x1b[1;36mConnected to: ' + data.hostname + '\x1b[0m');
-        term.writeln('');
+        term.reset();
+        if (data.reattached) {
+            // Server replays recent output right after this event
+            term.writeln('\x1b[1;32m✓ SSH session reattached\x1b[0m');
+        } else {
+            term.writeln('\x1b[1;32m✓ SSH session established\x1b[0m');
+            term.writeln('\x1b[1;36mConnected to: ' + data.hostname + '\x1b[0m');
+            term.writeln('');
+        }
 
         // Enable/disable buttons
         document.getElementById('connectBtn').disabled = true;
         document.getElementById('disconnectBtn').disabled = false;
         document.getElementById('reconnectBtn').disabled = false;
 
-        // Start output polling
-        startOutputPolling();
+        // Server pushes output when it can, otherwise fall back to polling
+        if (!data.push) {
+            startOutputPolling();
+        }
 
         // Start session timer
         startSessionTimer();
@@ -241,8 +282,8 @@ function initSocket() {
 
     socket.on('ssh_output', (data) => {
         if (data.session_id === currentSessionId) {
-            // Write output to terminal
-            term.write(data.data);
+            // Write output to terminal, acknowledge once xterm has processed it
+            term.write(data.data, () => acknowledgeOutput(data.bytes));
 
             // Update bytes received
             bytesReceived += data.data.length;
@@ -253,6 +294,35 @@ function initSocket() {
         }
     });
 
+    socket.on('ssh_data', (frame) => {
+        const view = new DataView(frame);
+        if (frame.byteLength <= FRAME_HEADER_BYTES || view.getUint32(0) !== currentChannel) {
+            return;
+        }
+
+        queueOutput({payload: new Uint8Array(frame, FRAME_HEADER_BYTES), rawLength: 0});
+        bytesReceived += frame.byteLength - FRAME_HEADER_BYTES;
+        updateStats();
+    });
+
+    socket.on('ssh_zdata', (frame) => {
+        const view = new DataView(frame);
+        if (frame.byteLength <= ZFRAME_HEADER_BYTES || view.getUint32(0) !== currentChannel || !inflateWriter) {
+            return;
+        }
+
+        queueOutput({payload: new Uint8Array(frame, ZFRAME_HEADER_BYTES), rawLength: view.getUint32(4)});
+        bytesReceived += frame.byteLength - ZFRAME_HEADER_BYTES;
+        updateStats();
+    });
+
+    // Lets the server measure the round trip to decide whether compression pays off
+    socket.on('ssh_rtt_probe', (data, ack) => {
+        if (ack) {
+            ack();
+        }
+    });
+
     socket.on('ssh_error', (data) => {
         term.writeln(`\x1b[1;31m✗ Error: ${data.message}\x1b[0m`);
         updateStatus('Connection error', 'disconnected');
@@ -268,7 +338,9 @@ function initSocket() {
     socket.on('disconnect', () => {
         console.log('WebSocket disconnected');
         updateStatus('Disconnected', 'disconnected');
-        disconnectSSH();
+
+        // Leave the SSH session running on the server, it is reattached on reconnect
+        cleanupSession();
     });
 }
 
@@ -293,12 +365,19 @@ function connectSSH() {
     term.writeln('\x1b[1;33mConnecting to SSH server...\x1b[0m');
 
     socket.emit('start_persistent_ssh', {
-        connection_id: connectionId
+        connection_id: connectionId,
+        push: true,
+        ack: true,
+        binary: true,
+        compression: inflateSupported ? 'deflate' : null,
+        resume: sessionStorage.getItem(attachedSessionKey())
     });
 }
 
 // Disconnect from SSH
 function disconnectSSH() {
+    sessionStorage.removeItem(attachedSessionKey());
+
     if (currentSessionId && socket) {
         socket.emit('close_persistent_ssh', {
             session_id: currentSessionId
@@ -308,10 +387,24 @@ function disconnectSSH() {
     cleanupSession();
 }
 
+function attachedSessionKey() {
+    return ATTACHED_KEY_PREFIX + document.getElementById('connectionId').value;
+}
+
 // Cleanup session
 function cleanupSession() {
     isConnected = false;
     currentSessionId = null;
+    currentChannel = null;
+    binaryFrames = false;
+    stopInflate();
+
+    // Drop pending acknowledgements
+    if (ackTimer) {
+        clearTimeout(ackTimer);
+        ackTimer = null;
+    }
+    pendingAckBytes = 0;
 
     // Stop polling
     if (outputPollingInterval) {
@@ -337,7 +430,7 @@ function cleanupSession() {
     document.getElementById('sessionTimer').textContent = '00:00:00';
 }
 
-// Start output polling
+// Start output polling (fallback when the server does not push output)
 function startOutputPolling() {
     if (outputPollingInterval) {
         clearInterval(outputPollingInterval);
@@ -352,6 +445,129 @@ function startOutputPolling() {
     }, 50);
 }
 
+// Write raw UTF-8 output, xterm decodes it itself
+function writeOutput(payload) {
+    term.write(payload, () => acknowledgeOutput(payload.length));
+    updateLastActivity();
+}
+
+// Keep raw and compressed frames in arrival order, one inflate at a time
+function queueOutput(frame) {
+    outputQueue.push(frame);
+    drainOutputQueue();
+}
+
+function drainOutputQueue() {
+    while (outputQueue.length && inflatePendingBytes === 0) {
+        const frame = outputQueue.shift();
+        if (frame.rawLength) {
+            inflatePendingBytes = frame.rawLength;
+            inflateWriter.write(frame.payload);
+        } else {
+            writeOutput(frame.payload);
+        }
+    }
+}
+
+// Some browsers have DecompressionStream but not the deflate-raw format
+function supportsDeflateRaw() {
+    try {
+        new DecompressionStream('deflate-raw');
+        return true;
+    } catch (e) {
+        return false;
+    }
+}
+
+function startInflate() {
+    stopInflate();
+
+    let stream;
+    try {
+        stream = new DecompressionStream('deflate-raw');
+    } catch (e) {
+        console.error('Inflate unavailable:', e);
+        return false;
+    }
+    const writer = stream.writable.getWriter();
+    const reader = stream.readable.getReader();
+    inflateWriter = writer;
+
+    (async () => {
+        while (true) {
+            const {value, done} = await reader.read();
+            if (done || inflateWriter !== writer) {
+                break;
+            }
+
+            writeOutput(value);
+            inflatePendingBytes = Math.max(0, inflatePendingBytes - value.length);
+            if (inflatePendingBytes === 0) {
+                drainOutputQueue();
+            }
+        }
+    })().catch(err => console.error('Inflate error:', err));
+    return true;
+}
+
+function stopInflate() {
+    if (inflateWriter) {
+        inflateWriter.abort().catch(() => {});
+        inflateWriter = null;
+    }
+    inflatePendingBytes = 0;
+    outputQueue = [];
+}
+
+// Send terminal input, as a binary frame when the session supports it
+function sendInput(data) {
+    if (!socket || !currentSessionId) {
+        return;
+    }
+
+    if (binaryFrames) {
+        const payload = textEncoder.encode(data);
+        const frame = new Uint8Array(FRAME_HEADER_BYTES + payload.length);
+        new DataView(frame.buffer).setUint32(0, currentChannel);
+        frame.set(payload, FRAME_HEADER_BYTES);
+        socket.emit('ssh_data', frame.buffer);
+    } else {
+        socket.emit('persistent_ssh_input', {
+            session_id: currentSessionId,
+            data: data
+        });
+    }
+}
+
+// Acknowledge pushed output written to the terminal
+function acknowledgeOutput(size) {
+    if (!size || !currentSessionId) {
+        return;
+    }
+
+    pendingAckBytes += size;
+    if (pendingAckBytes >= ACK_BATCH_BYTES) {
+        flushOutputAck();
+    } else if (!ackTimer) {
+        ackTimer = setTimeout(flushOutputAck, ACK_DELAY_MS);
+    }
+}
+
+function flushOutputAck() {
+    if (ackTimer) {
+        clearTimeout(ackTimer);
+        ackTimer = null;
+    }
+
+    if (pendingAckBytes > 0 && socket && currentSessionId) {
+        socket.emit('ssh_output_ack', {
+            session_id: currentSessionId,
+            bytes: pendingAckBytes
+        });
+    }
+    pendingAckBytes = 0;
+}
+
 // Session timer
 let sessionTimerInterval = null;
 function startSessionTimer() {
@@ -404,10 +620,7 @@ function executeQuickCommand(command) {
     // Kirim command ke terminal dengan Enter (\r)
     const fullCommand = command + '\r';
     
-    socket.emit('persistent_ssh_input', {
-        session_id: currentSessionId,
-        data: fullCommand
-    });
+    sendInput(fullCommand);
 
     // Update bytes sent
     bytesSent += fullCommand.length;
@@ -529,17 +742,11 @@ function setupEventListeners() {
         if (e.ctrlKey && isConnected) {
             if (e.key === 'c') {
                 // Ctrl+C - interrupt
-                socket.emit('persistent_ssh_input', {
-                    session_id: currentSessionId,
-                    data: '\x03'
-                });
+                sendInput('\x03');
                 e.preventDefault();
             } else if (e.key === 'd') {
                 // Ctrl+D - exit/EOF
-                socket.emit('persistent_ssh_input', {
-                    session_id: currentSessionId,
-                    data: '\x04'
-                });
+                sendInput('\x04');
                 e.preventDefault();
             } else if (e.key === 'l') {
                 // Ctrl+L - clear screen
@@ -559,10 +766,7 @@ function setupEventListeners() {
             }
 
             if (sequence) {
-                socket.emit('persistent_ssh_input', {
-                    session_id: currentSessionId,
-                    data: sequence
-                });
+                sendInput(sequence);
                 e.preventDefault();
             }
         }
@@ -0,0 +1,71 @@
+import collections
+import threading
+import time
+import logging
+from sqlalchemy.orm import make_transient_to_detached
+from database import db
+from auth import User
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class UserCache:
+    """Identity cache for Flask-Login's user loader
+
+    current_user is loaded on every request and every Socket.IO event,
+    keystrokes included. Users are kept as detached snapshots and merged
+    into the request's session without a query. Entries expire after ttl
+    seconds, so changes made elsewhere are picked up, and must be
+    invalidated when the user is changed here.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()  # Format: {user_id: (snapshot, expires_at)}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, user_id):
+        """User attached to the current session, None if there is no such user"""
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry and entry[1] < time.monotonic():
+                del self.entries[user_id]
+                entry = None
+            if entry:
+                self.entries.move_to_end(user_id)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if entry:
+            # Copies the snapshot into the session, load=False skips the SELECT
+            return db.session.merge(entry[0], load=False)
+
+        user = db.session.get(User, user_id)
+        if user is not None:
+            self.put(user)
+        return user
+
+    def put(self, user):
+        snapshot = User(**{column.key: getattr(user, column.key) for column in User.__table__.columns})
+        make_transient_to_detached(snapshot)
+        with self.lock:
+            self.entries[user.id] = (snapshot, time.monotonic() + self.ttl)
+            self.entries.move_to_end(user.id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """Forget a user after changing its row"""
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def stats(self):
+        with self.lock:
+            return {'users': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+# Global instance
+user_cache = UserCache(Config.USER_CACHE_SECONDS, Config.USER_CACHE_SIZE)
@@ -0,0 +1,178 @@
+import eventlet
+import os
+import signal
+import subprocess
+import sys
+import time
+import zlib
+import logging
+from http.cookies import SimpleCookie, CookieError
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+MAX_HEAD_BYTES = 64 * 1024
+
+def worker_for_user(user_id, workers):
+    """Worker owning the SSH sessions of a user"""
+    return user_id % workers
+
+class AffinityRouter:
+    """Front TCP proxy that sends every request of a user to the same worker
+
+    A paramiko channel lives in the worker process that opened it, so all
+    Socket.IO traffic of a session has to reach that worker. Workers put
+    each logged in user on worker_for_user() and tell the browser through
+    the affinity cookie, requests without it (login page, static files) are
+    spread by client address. Requests are routed one at a time: the
+    request is forwarded with Connection: close, only WebSocket upgrades
+    keep their connection.
+    """
+
+    def __init__(self, backends, cookie_name):
+        self.backends = backends  # Format: [(host, port), ...] indexed by worker number
+        self.cookie_name = cookie_name
+
+    def serve(self, host, port):
+        server = eventlet.listen((host, port))
+        pool = eventlet.GreenPool(10000)
+        while True:
+            client, address = server.accept()
+            pool.spawn_n(self.handle, client, address)
+
+    def handle(self, client, address):
+        backend = None
+        try:
+            head = self._read_head(client)
+            if head is None:
+                return
+
+            worker = self.choose_worker(head, address)
+            try:
+                backend = eventlet.connect(self.backends[worker])
+            except OSError as e:
+                logger.error(f"Worker {worker} unreachable: {e}")
+                client.sendall(b'HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                return
+
+            backend.sendall(self._rewrite_head(head, address))
+            # Client -> worker in the background, worker -> client here
+            eventlet.spawn_n(self._pipe, client, backend)
+            self._pipe(backend, client)
+        except Exception as e:
+            logger.debug(f"Proxy connection error: {e}")
+        finally:
+            for sock in (client, backend):
+                if sock is not None:
+                    try:
+                        sock.close()
+                    except OSError:
+                        pass
+
+    def choose_worker(self, head, address):
+        header_end = head.index(b'\r\n\r\n')
+        for line in head[:header_end].split(b'\r\n')[1:]:
+            name, _, value = line.partition(b':')
+            if name.strip().lower() != b'cookie':
+                continue
+            try:
+                cookie = SimpleCookie(value.strip().decode('latin-1'))
+            except CookieError:
+                continue
+            if self.cookie_name in cookie and cookie[self.cookie_name].value.isdigit():
+                worker = int(cookie[self.cookie_name].value)
+                if worker < len(self.backends):
+                    return worker
+        # Not logged in yet, keep a client on one worker anyway
+        return zlib.crc32(address[0].encode()) % len(self.backends)
+
+    def _read_head(self, client):
+        head = b''
+        while b'\r\n\r\n' not in head:
+            chunk = client.recv(8192)
+            if not chunk:
+                return None
+            head += chunk
+            if len(head) > MAX_HEAD_BYTES:
+                client.sendall(b'HTTP/1.1 431 Request Header Fields Too Large\r\n'
+                               b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+                return None
+        return head
+
+    def _rewrite_head(self, head, address):
+        """One request per connection unless it upgrades, and pass on the client address"""
+        header_end = head.index(b'\r\n\r\n')
+        lines = head[:header_end].split(b'\r\n')
+        body = head[header_end + 4:]
+
+        upgrade = any(line.lower().startswith(b'upgrade:') for line in lines[1:])
+        kept = [lines[0]]
+        for line in lines[1:]:
+            name = line.partition(b':')[0].strip().lower()
+            if name in (b'x-forwarded-for', b'x-real-ip') or (name == b'connection' and not upgrade):
+                continue
+            kept.append(line)
+        if not upgrade:
+            kept.append(b'Connection: close')
+        kept.append(b'X-Forwarded-For: ' + address[0].encode())
+        return b'\r\n'.join(kept) + b'\r\n\r\n' + body
+
+    def _pipe(self, source, destination):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                destination.sendall(data)
+        except (OSError, EOFError):
+            # EOFError when the other direction closed the socket under us
+            pass
+        finally:
+            # Let the other direction finish on its own
+            try:
+                destination.shutdown(1)
+            except OSError:
+                pass
+
+def run_workers(script, workers, host, port):
+    """Start workers running script and route port to them, until stopped
+
+    Each worker gets WORKER_INDEX and listens on WORKER_BASE_PORT + index,
+    all share the live session registry. Crashed workers are restarted.
+    """
+    backends = [('127.0.0.1', Config.WORKER_BASE_PORT + index) for index in range(workers)]
+    processes = {}
+
+    def start(index):
+        env = dict(os.environ, WORKER_INDEX=str(index), SESSION_REGISTRY='sqlite')
+        processes[index] = subprocess.Popen([sys.executable, script], env=env)
+
+    def stop(signum=None, frame=None):
+        for process in processes.values():
+            if process.poll() is None:
+                process.terminate()
+        deadline = time.time() + 10
+        for process in processes.values():
+            try:
+                process.wait(max(0.1, deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+        sys.exit(0)
+
+    def supervise():
+        while True:
+            eventlet.sleep(2)
+            for index, process in list(processes.items()):
+                if process.poll() is not None:
+                    logger.error(f"Worker {index} exited with {process.returncode}, restarting")
+                    start(index)
+
+    for index in range(workers):
+        start(index)
+    signal.signal(signal.SIGTERM, stop)
+    eventlet.spawn(supervise)
+
+    try:
+        AffinityRouter(backends, Config.WORKER_AFFINITY_COOKIE).serve(host, port)
+    finally:
+        stop()